@@ -15,6 +15,13 @@ Required Options
   The name of the sampling strategy to use.
   The sampling strategy must be registered by using the
   ``SamplingStrategyRegistry.register`` function for it to be recognized.
+  Strategies are imported when a table first uses them. Strategies in other
+  packages are found through entry points in the ``samplingfdw.strategies``
+  group, named after the strategy, for example
+  ``entry_points={'samplingfdw.strategies': ['my_strategy = my_package.my_module:MyStrategy']}``.
+  Modules added to the ``samplingfdw`` package are found fastest when they are
+  named after the strategy they register, and are otherwise found by
+  importing every module of the package.
 
 ``name``
   The name of the FDW connection, for use in ``MetadataFdw``.
@@ -27,6 +34,13 @@ remote column data.
 Moreover, the local column types will be used to interpret
 the results in the remote table.
 
+The table can also declare a ``_sample_weight double precision`` column, which
+is not read from the remote table. It holds the inverse of the probability
+with which each row was sampled by the sampling strategy, and is 1 for rows
+read from the remote table, so ``SUM(x * _sample_weight)`` estimates
+``SUM(x)`` over the remote table when queries are answered from a sample, as
+with ``weighted_sampling_strategy``.
+
 Connection Options
 ~~~~~~~~~~~~~~~~~~
 
@@ -60,6 +74,91 @@ Connection Options
 ``remote_port``
   The remote port.
 
+``remote_replicas``
+  A comma delimited list of read replicas of the remote database, as ``host``
+  or ``host:port`` entries. Replicas use the other remote connection options.
+  Reads from the remote database are spread across the replicas, while writes
+  always go to the primary. If no replica can be used, reads go to the
+  primary. Unless ``replica_max_lag`` is set, rows read from a replica are not
+  kept in the row cache, the negative cache or the local database, and reads
+  whose rows are kept go to the primary.
+
+``replica_max_lag``
+  The maximum number of seconds a replica may be behind the primary for reads
+  to be sent to it. After a write through the FDW, reads go to the primary for
+  this many seconds. Unset by default, which never checks replication lag.
+
+``replica_check_interval``
+  The number of seconds between checks of the replication lag of a replica.
+  Defaults to 10.
+
+``replica_retry_seconds``
+  The number of seconds a replica that failed is not used. Defaults to 30.
+
+Caching Options
+~~~~~~~~~~~~~~~
+
+``row_cache_size``
+  The maximum number of rows kept in an in-process cache of rows keyed by the
+  ``primary_key`` option. Queries whose only qualifier is an equality or a
+  small ``IN`` list on the primary key are answered from this cache without
+  querying either database. Defaults to 0, which disables the cache.
+
+``row_cache_ttl``
+  The number of seconds a row stays in the row cache. Defaults to 60.
+
+``row_cache_max_keys``
+  The maximum number of keys in an ``IN`` list answered from the row cache.
+  Defaults to 16.
+
+``negative_cache_size``
+  The maximum number of queries remembered as returning no rows from the
+  remote database. Repeating such a query returns no rows without querying
+  either database, until a row that could match it is inserted or updated
+  through the FDW. Defaults to 0, which disables the cache.
+
+``negative_cache_ttl``
+  The number of seconds a query is remembered as returning no rows. Defaults
+  to 60.
+
+Latency Options
+~~~~~~~~~~~~~~~
+
+``hedge_delay``
+  If set, the remote query for a fetch is started on a worker thread with its
+  own remote connection this many seconds after the local query, instead of
+  only after the local query has missed. If the local database answers the
+  query first, the remote query is cancelled. Unset by default, which disables
+  hedged fetches.
+
+``cost_based_routing``
+  If ``true``, the latencies and row counts of fetches are recorded per query
+  shape, and queries whose shape is cheaper to answer remotely are sent
+  straight to the remote database, instead of first trying the local
+  database. Queries are not routed while the sampling strategy answers them
+  differently from the remote database, as with ``answer_from_sample``. The
+  decision for a query is shown by ``EXPLAIN``. Defaults to ``false``.
+
+``routing_explore_every``
+  With cost based routing, every this many queries of a shape are routed to
+  the source that was not chosen, to keep its estimate up to date. Defaults
+  to 20.
+
+Tracing Options
+~~~~~~~~~~~~~~~
+
+``trace``
+  If ``true``, every query is recorded in a table in the local database with
+  its quals, requested columns and sort keys, where its rows came from, the
+  time taken by each phase and by the whole scan, and the number of rows
+  returned. Recorded queries can be run again against another table with
+  ``scripts/replay_trace.py``.
+  Defaults to ``false``.
+
+``trace_table``
+  The name of the table queries are recorded in. Defaults to
+  ``_samplingfdw_trace``.
+
 Usage example
 -------------
 
@@ -95,23 +194,27 @@ For a connection to a listing of all the active local ``SamplingFdw``s:
 
 """
 
-import importlib
 import itertools
 import logging
-from multicorn import ForeignDataWrapper, ColumnDefinition, Qual, SortKey
+from multicorn import ForeignDataWrapper, ColumnDefinition, Qual, SortKey, ANY
 from multicorn.utils import log_to_postgres
 import pkgutil
 import psycopg2
-from typing import Dict, List, Iterable, Any
-
+import time
+from typing import Dict, List, Iterable, Any, Hashable, Optional
+
+from samplingfdw.hedged_fetch import HedgedFetch
+from samplingfdw.negative_cache import NegativeCache
+from samplingfdw.query_router import QueryRouter, LOCAL, REMOTE
+from samplingfdw.replica_pool import ReplicaPool
+from samplingfdw.row_cache import RowCache
+from samplingfdw.sampling_strategy import SamplingStrategy, SAMPLE_WEIGHT_COLUMN
 from samplingfdw.sampling_strategy_registry import SamplingStrategyRegistry
+from samplingfdw.tracer import Trace, Tracer
 
-# Ensure that every other python file in this directory gets included in this
-# file, so every registered SamplingStrategy will be found.
+# Strategies are imported by SamplingStrategyRegistry when they are first
+# used, and can also be modules in other portions of this package.
 __path__ = pkgutil.extend_path(__path__, __name__)
-for _, modname, _ in pkgutil.walk_packages(
-        path=__path__, prefix=__name__ + "."):
-    importlib.import_module(modname)
 
 
 class SamplingFdw(ForeignDataWrapper):
@@ -133,27 +236,76 @@ class SamplingFdw(ForeignDataWrapper):
                     "The options passed to {} should contain a {} field".
                     format(self.__class__.__name__, option), logging.ERROR)
 
-        self.local_options = {}  # type: Dict[str, str]
-        self.remote_options = {}  # type: Dict[str, str]
-        for connection_param in ["dbname", "user", "password", "host", "port"]:
-            if "local_" + connection_param in options:
-                self.local_options[connection_param] = (
-                    options["local_" + connection_param])
-            if "remote_" + connection_param in options:
-                self.remote_options[connection_param] = (
-                    options["remote_" + connection_param])
+        self.local_options = SamplingStrategy.connection_options(
+            options, "local_")  # type: Dict[str, str]
+        self.remote_options = SamplingStrategy.connection_options(
+            options, "remote_")  # type: Dict[str, str]
         self._local_connection = None  # type: psycopg2.connection
         self._remote_connection = None  # type: psycopg2.connection
+        self._hedge_connection = None  # type: psycopg2.connection
+        self._hedge_options = None  # type: Optional[Dict[str, str]]
+        # Whether the query being answered read from a replica whose lag is
+        # not bounded, so its rows must not be cached
+        self._unbounded_read = False
 
         self.table_name = options["table_name"]
+        self.strategy_name = options["sampling_strategy"]
         self.sampling_strategy = SamplingStrategyRegistry.get_strategy(
-            options["sampling_strategy"])(self.table_name, options, columns)
+            self.strategy_name)(self.table_name, options, columns)
         self.registry[options["name"]] = self
 
-        with self.remote_connection, self.local_connection:
+        self.replica_pool = ReplicaPool.from_options(
+            options, self.remote_options)  # type: Optional[ReplicaPool]
+        self.sampling_strategy.replica_pool = self.replica_pool
+
+        self.primary_key = options.get("primary_key", None)
+        self.row_cache = None  # type: Optional[RowCache]
+        if int(options.get("row_cache_size", 0)) > 0:
+            if self.primary_key is None:
+                log_to_postgres(
+                    "You need to declare a primary_key option in order to use the row cache",
+                    logging.ERROR)
+            if self.primary_key not in columns:
+                log_to_postgres(
+                    "Expected primary key {} to be a column of {}".format(
+                        self.primary_key, self.table_name), logging.ERROR)
+            self.row_cache = RowCache(
+                int(options["row_cache_size"]),
+                float(options.get("row_cache_ttl", 60)))
+            # The position of the primary key column in sequence rows
+            self._primary_key_index = list(columns).index(self.primary_key)
+            self.row_cache_max_keys = int(
+                options.get("row_cache_max_keys", 16))
+
+        self.hedge_delay = None  # type: Optional[float]
+        if "hedge_delay" in options:
+            self.hedge_delay = float(options["hedge_delay"])
+
+        self.router = None  # type: Optional[QueryRouter]
+        if options.get("cost_based_routing", "false") == "true":
+            self.router = QueryRouter(
+                int(options.get("routing_explore_every", 20)))
+
+        self.negative_cache = None  # type: Optional[NegativeCache]
+        if int(options.get("negative_cache_size", 0)) > 0:
+            self.negative_cache = NegativeCache(
+                int(options["negative_cache_size"]),
+                float(options.get("negative_cache_ttl", 60)))
+
+        self.tracer = None  # type: Optional[Tracer]
+        # The trace of the query being answered, if tracing is enabled
+        self._trace = None  # type: Optional[Trace]
+        if options.get("trace", "false") == "true":
+            self.tracer = Tracer(
+                options["name"],
+                options.get("trace_table", "_samplingfdw_trace"))
+
+        read_connection = self.read_connection
+        with read_connection, self.local_connection:
             self.rows_stored_locally = self.sampling_strategy.on_open(
-                self.remote_connection.cursor(),
-                self.local_connection.cursor())
+                read_connection.cursor(), self.local_connection.cursor())
+            if self.tracer is not None:
+                self.tracer.create_table(self.local_connection.cursor())
 
     def execute(self, quals, columns, pathkeys=[]):
         # type: (List[Qual], List[str], List[SortKey]) -> Iterable[Any]
@@ -164,22 +316,355 @@ class SamplingFdw(ForeignDataWrapper):
         If no results are returned, the remote database will be queried, and
         the results of the query will be inserted into the local database using
         the sampling strategy, and returned to the user.
+
+        If the row cache is enabled and the query only selects rows by primary
+        key, cached rows are returned without querying either database, and the
+        rows fetched on a miss are stored in the row cache.
+        If the negative cache is enabled, queries that recently returned no
+        rows from the remote database return no rows without querying either
+        database.
+        If trace is set, the query is recorded in the trace table once the
+        scan ends, even if it stops before all of its rows are returned.
         """
-        with self.local_connection:
-            local_results = self.sampling_strategy.fetch_locally(
-                self.local_connection.cursor(), quals, columns, pathkeys)
+        # Postgres rechecks every qual, so quals on the sample weight, which
+        # the remote table does not have, can be left out
+        quals = [
+            qual for qual in quals if qual.field_name != SAMPLE_WEIGHT_COLUMN
+        ]
+        if self.tracer is None:
+            return self._execute(quals, columns, pathkeys)
+        trace = self._trace = Trace(quals, columns, pathkeys)
+        try:
+            rows = self._execute(quals, columns, pathkeys)
+        finally:
+            self._trace = None
+        return self._record_trace(rows, trace)
+
+    def _execute(self, quals, columns, pathkeys):
+        # type: (List[Qual], List[str], List[SortKey]) -> Iterable[Any]
+        """Fetches data from the caches if possible, and from the databases
+        otherwise.
+        """
+        if self.negative_cache is not None and quals in self.negative_cache:
+            self._traced("negative_cache")
+            return []
+        self._unbounded_read = False
+        keys = self._point_lookup_keys(quals)
+        if keys is None:
+            return self._fetch(quals, columns, pathkeys)
+        rows = self.row_cache.get_many(keys, columns)
+        if rows is not None:
+            self._traced("row_cache")
+            return rows
+        rows = self._fetch(quals, columns, pathkeys)
+        if self._unbounded_read:
+            return rows
+        return self._cache_rows(rows, columns)
+
+    def explain(self, quals, columns, sortkeys=None, verbose=False):
+        # type: (List[Qual], List[str], List[SortKey], bool) -> List[str]
+        """Returns lines for EXPLAIN describing how the query would be
+        answered: whether the caches cover it, which database it would be
+        tried on first, and the SQL the sampling strategy would send to each
+        database.
+        """
+        quals = [
+            qual for qual in quals if qual.field_name != SAMPLE_WEIGHT_COLUMN
+        ]
+        lines = ["Sampling strategy: " + self.strategy_name]
+        if self.negative_cache is not None and self.negative_cache.covers(
+                quals):
+            lines.append("Negative cache: hit, no rows are returned")
+        keys = self._point_lookup_keys(quals)
+        if keys is not None:
+            lines.append("Row cache: {} of {} keys cached".format(
+                self.row_cache.count_cached(keys, columns), len(keys)))
+        if self.router is None or not self.sampling_strategy.routable:
+            lines.append("Routing: local first")
+        else:
+            source, local_cost, remote_cost = self.router.estimate(
+                self.router.shape(quals, columns))
+            lines.append(
+                "Routing: {} (estimated local first: {}, remote: {})".format(
+                    "local first" if source == LOCAL else "remote",
+                    *("unknown" if cost is None else "{:.3f} ms".format(
+                        cost * 1000) for cost in [local_cost, remote_cost])))
+        return lines + self.sampling_strategy.explain(quals, columns,
+                                                      sortkeys)
+
+    def _traced(self, routing=None, phase=None, start=None):
+        # type: (Optional[str], Optional[str], Optional[float]) -> None
+        """Records where the rows of the query being traced came from, and
+        how long a phase that started at start took, if tracing is enabled.
+        """
+        if self._trace is None:
+            return
+        if routing is not None:
+            self._trace.routing = routing
+        if phase is not None:
+            self._trace.phases[phase] = time.time() - start
+
+    def _record_trace(self, rows, trace):
+        # type: (Iterable[Any], Trace) -> Iterable[Any]
+        """Returns the supplied rows, and writes the trace of the query with
+        the number of rows returned to the trace table once the scan ends,
+        including scans that are stopped early by LIMIT or cancelled.
+        """
+        count = 0
+        try:
+            for row in rows:
+                count += 1
+                yield row
+        finally:
+            trace.finish()
+            try:
+                with self.local_connection:
+                    self.tracer.record(self.local_connection.cursor(), trace,
+                                       count)
+            except psycopg2.Error as e:
+                log_to_postgres(
+                    "Could not record the trace of a query: " + str(e),
+                    logging.WARNING)
+
+    def _fetch(self, quals, columns, pathkeys):
+        # type: (List[Qual], List[str], List[SortKey]) -> Iterable[Any]
+        """Fetches data from the local database if the sampling strategy can
+        answer the query locally, and from the remote database otherwise.
+
+        If hedge_delay is set, the remote query runs on a worker thread
+        concurrently with the local query, and is cancelled if the local query
+        answers first.
+        Remote queries are sent to a read replica if any is usable.
+        If cost_based_routing is set, queries that the router estimates to be
+        cheaper to answer remotely skip the local database, unless the
+        sampling strategy answers differently from the remote database.
+        """
+        shape = None  # type: Optional[Hashable]
+        source = LOCAL
+        if self.router is not None and self.sampling_strategy.routable:
+            shape = self.router.shape(quals, columns)
+            source = self.router.route(shape)
+
+        if source == LOCAL:
+            local_results = self._fetch_locally(quals, columns, pathkeys,
+                                                shape)
+            if local_results is not None:
+                return local_results
+
+        start = time.time()
+        remote_results = self._fetch_remotely_and_store(
+            quals, columns, pathkeys)
+        if shape is not None:
+            seconds = time.time() - start
+            self.router.record(shape, REMOTE, seconds)
+            remote_results = self._record_fetch(remote_results, shape, REMOTE,
+                                                seconds)
+        if self.negative_cache is not None and not self._unbounded_read:
+            return self._record_empty_results(quals, remote_results)
+        return remote_results
+
+    def _fetch_locally(self, quals, columns, pathkeys, shape=None):
+        # type: (List[Qual], List[str], List[SortKey], Optional[Hashable]) -> Optional[Iterable[Any]]
+        """Fetches data from the local database, or returns None if the
+        sampling strategy cannot answer the query locally.
+
+        If hedge_delay is set, the remote query is started on a worker thread,
+        and its rows are stored locally and returned if the local database
+        cannot answer the query.
+        """
+        hedged_fetch = None  # type: Optional[HedgedFetch]
+        # The hedge connection may go to a replica, which might not have the
+        # writes of this backend yet
+        if self.hedge_delay is not None and (
+                self.replica_pool is None or
+                not self.replica_pool.reading_from_primary):
+            hedged_fetch = HedgedFetch(
+                self.hedge_connection,
+                lambda cursor: self.sampling_strategy.fetch_remotely(
+                    cursor, quals, columns, pathkeys),
+                self.hedge_delay)
+
+        start = time.time()
+        try:
+            with self.local_connection:
+                local_results = self.sampling_strategy.fetch_locally(
+                    self.local_connection.cursor(), quals, columns, pathkeys)
+        except Exception:
+            # The worker must not outlive the query, as the next one would
+            # start another worker on the same connection
+            if hedged_fetch is not None:
+                hedged_fetch.cancel()
+            raise
+        self._traced(phase="local", start=start)
+        if shape is not None:
+            seconds = time.time() - start
+            self.router.record(
+                shape, LOCAL, seconds, answered=local_results is not None)
+            if local_results is not None:
+                local_results = self._record_fetch(local_results, shape,
+                                                   LOCAL, seconds)
         if local_results is not None:
+            if hedged_fetch is not None:
+                hedged_fetch.cancel()
+            self._traced("local")
             return local_results
+        if hedged_fetch is None:
+            return None
 
-        with self.remote_connection, self.local_connection:
-            remote_results = self.sampling_strategy.fetch_remotely(
-                self.remote_connection.cursor(), quals, columns, pathkeys)
-            remote_results, remote_results_copy = itertools.tee(remote_results)
+        start = time.time()
+        remote_results = hedged_fetch.result()
+        self._traced("hedged_remote", "remote", start)
+        start = time.time()
+        with self.local_connection:
+            self.rows_stored_locally += (
+                self.sampling_strategy.store_results_locally(
+                    self.local_connection.cursor(), iter(remote_results)))
+        self._traced(phase="store", start=start)
+        if self.negative_cache is not None:
+            return self._record_empty_results(quals, remote_results)
+        return remote_results
+
+    def _fetch_remotely_and_store(self, quals, columns, pathkeys):
+        # type: (List[Qual], List[str], List[SortKey]) -> Iterable[Any]
+        """Fetches data from the remote database, and stores it locally using
+        the sampling strategy, unless it was read from a replica whose lag is
+        not bounded.
+        """
+        start = time.time()
+        remote_results = self._fetch_remotely(quals, columns, pathkeys)
+        self._traced("remote", "remote", start)
+        if self._unbounded_read:
+            return remote_results
+        start = time.time()
+        with self.local_connection:
+            remote_results, remote_results_copy = itertools.tee(
+                remote_results)
             self.rows_stored_locally += (
                 self.sampling_strategy.store_results_locally(
                     self.local_connection.cursor(), remote_results))
+        self._traced(phase="store", start=start)
         return remote_results_copy
 
+    def _record_fetch(self, rows, shape, source, seconds):
+        # type: (Iterable[Any], Hashable, str, float) -> Iterable[Any]
+        """Returns the supplied rows, and records how many there were in the
+        router once all of them are returned.
+        """
+        count = 0
+        for row in rows:
+            count += 1
+            yield row
+        self.router.record_rows(shape, source, seconds, count)
+
+    def _fetch_remotely(self, quals, columns, pathkeys):
+        # type: (List[Qual], List[str], List[SortKey]) -> Iterable[Any]
+        """Fetches data from a read replica of the remote database if any is
+        usable, and from the primary otherwise.
+
+        If the query fails on a replica because of a connection problem, the
+        replica is not used for replica_retry_seconds and the query is retried
+        on another replica. Rows read from a replica are read in full before
+        they are returned, so that this also covers errors raised while they
+        are read. If replica_max_lag is not set, reading from a replica marks
+        the rows as not to be cached.
+        """
+        while self.replica_pool is not None:
+            replica = self.replica_pool.choose()
+            if replica is None:
+                break
+            start = time.time()
+            try:
+                with replica.connection:
+                    results = list(
+                        self.sampling_strategy.fetch_remotely(
+                            replica.connection.cursor(), quals, columns,
+                            pathkeys))
+            except psycopg2.OperationalError:
+                replica.mark_failed(self.replica_pool.retry_seconds)
+                continue
+            replica.record_latency(time.time() - start)
+            self._unbounded_read = self.replica_pool.max_lag is None
+            return results
+
+        with self.remote_connection:
+            return self.sampling_strategy.fetch_remotely(
+                self.remote_connection.cursor(), quals, columns, pathkeys)
+
+    def _record_empty_results(self, quals, rows):
+        # type: (List[Qual], Iterable[Any]) -> Iterable[Any]
+        """Returns the supplied remote rows, and adds the supplied quals to
+        the negative cache if there were none.
+        """
+        empty = True
+        for row in rows:
+            empty = False
+            yield row
+        if empty:
+            self.negative_cache.add(quals)
+
+    def _point_lookup_keys(self, quals):
+        # type: (List[Qual]) -> Optional[List[Hashable]]
+        """Returns the primary key values selected by the supplied quals if
+        they can be answered from the row cache, or None otherwise.
+        """
+        if self.row_cache is None or len(quals) != 1:
+            return None
+        qual = quals[0]
+        if qual.field_name != self.primary_key:
+            return None
+        if qual.operator == "=":
+            return [qual.value]
+        if (qual.is_list_operator and qual.operator[0] == "=" and
+                qual.list_any_or_all == ANY and
+                len(qual.value) <= self.row_cache_max_keys):
+            # The database returns a row once however often its key is
+            # listed
+            keys = []  # type: List[Hashable]
+            for key in qual.value:
+                if key not in keys:
+                    keys.append(key)
+            return keys
+        return None
+
+    def _row_key(self, row):  # type: (Any) -> Optional[Hashable]
+        """Returns the primary key value of a row returned by the sampling
+        strategy.
+        """
+        if isinstance(row, dict):
+            return row.get(self.primary_key, None)
+        return row[self._primary_key_index]
+
+    def _cache_rows(self, rows, columns):
+        # type: (Iterable[Any], List[str]) -> Iterable[Any]
+        """Stores the supplied rows in the row cache as they are returned."""
+        columns = frozenset(columns)
+        for row in rows:
+            key = self._row_key(row)
+            if key is not None:
+                self.row_cache.put(key, row, columns)
+            yield row
+
+    def _invalidate_rows(self, *values):  # type: (*Dict[str, Any]) -> None
+        """Removes the rows with the primary keys in the supplied values from
+        the row cache.
+        """
+        if self.row_cache is None:
+            return
+        for row_values in values:
+            if self.primary_key in row_values:
+                self.row_cache.invalidate(row_values[self.primary_key])
+
+    @staticmethod
+    def _stored_values(values):  # type: (Dict[str, Any]) -> Dict[str, Any]
+        """Returns the supplied column values without the sample weight, which
+        is not stored in the remote table.
+        """
+        return {
+            column: value
+            for column, value in values.items()
+            if column != SAMPLE_WEIGHT_COLUMN
+        }
+
     @property
     def rowid_column(self):  # type: () -> str
         """Primary key column of the remote database."""
@@ -189,6 +674,12 @@ class SamplingFdw(ForeignDataWrapper):
         """This function will insert the supplied values into both the local
         and remote database using the user-defined sampling strategy.
         """
+        values = self._stored_values(values)
+        self._invalidate_rows(values)
+        if self.replica_pool is not None:
+            self.replica_pool.record_write()
+        if self.negative_cache is not None:
+            self.negative_cache.invalidate(values)
         with self.local_connection, self.remote_connection:
             self.rows_stored_locally += self.sampling_strategy.insert_locally(
                 self.local_connection.cursor(), values)
@@ -201,6 +692,13 @@ class SamplingFdw(ForeignDataWrapper):
         """This function will update the supplied values in both the local and
         remote database using the user-defined sampling strategy.
         """
+        oldvalues = self._stored_values(oldvalues)
+        newvalues = self._stored_values(newvalues)
+        self._invalidate_rows(oldvalues, newvalues)
+        if self.replica_pool is not None:
+            self.replica_pool.record_write()
+        if self.negative_cache is not None:
+            self.negative_cache.invalidate(newvalues)
         with self.local_connection, self.remote_connection:
             self.rows_stored_locally += self.sampling_strategy.update_locally(
                 self.local_connection.cursor(), oldvalues, newvalues)
@@ -212,6 +710,10 @@ class SamplingFdw(ForeignDataWrapper):
         """This function will delete the supplied values in both the local and
         remote database using the user-defined sampling strategy.
         """
+        oldvalues = self._stored_values(oldvalues)
+        self._invalidate_rows(oldvalues)
+        if self.replica_pool is not None:
+            self.replica_pool.record_write()
         with self.local_connection, self.remote_connection:
             self.rows_stored_locally -= self.sampling_strategy.delete_locally(
                 self.local_connection.cursor(), oldvalues)
@@ -233,6 +735,38 @@ class SamplingFdw(ForeignDataWrapper):
             self._remote_connection = psycopg2.connect(**self.remote_options)
         return self._remote_connection
 
+    @property
+    def read_connection(self):  # type: () -> psycopg2.connection
+        """Returns a connection for reads from the remote database whose rows
+        are stored locally, to a read replica if any is usable and its lag is
+        bounded, and to the primary otherwise.
+        """
+        if self.replica_pool is not None and (
+                self.replica_pool.max_lag is not None):
+            replica = self.replica_pool.choose()
+            if replica is not None:
+                return replica.connection
+        return self.remote_connection
+
+    @property
+    def hedge_connection(self):  # type: () -> psycopg2.connection
+        """Returns a connection to the remote database that is only used by
+        hedged fetches, so they can be cancelled independently.
+
+        The connection goes to a read replica if any with a recently checked,
+        bounded lag is usable. It is reopened if it was closed, or if the
+        replica it goes to can no longer be read from.
+        """
+        options = self.sampling_strategy.read_connection_options(
+            self._hedge_options)
+        if (self._hedge_connection is None or self._hedge_connection.closed or
+                options != self._hedge_options):
+            if self._hedge_connection is not None:
+                self._hedge_connection.close()
+            self._hedge_connection = psycopg2.connect(**options)
+            self._hedge_options = options
+        return self._hedge_connection
+
 
 class MetadataFdw(ForeignDataWrapper):
     """A foreign data wrapper that stores metadata about all active SamplingFdws.
@@ -241,17 +775,39 @@ class MetadataFdw(ForeignDataWrapper):
         name                -- the name supplied when opening the SamplingFdw
         table_name          -- the name of the table supplied when opening the SamplingFdw
         rows_stored_locally -- the number of rows stored in the local database for the SamplingFdw
+
+    Sampling strategies can list additional statistics, such as
+    prefetch_hit_rate, by returning them from SamplingStrategy.metadata. These
+    are available as columns with the same names, as is replicas, which lists
+    the read replicas of the remote database and whether they are healthy.
+    With cost based routing, routed_locally and routed_remotely count the
+    queries that were first tried on each database. strategy_import_seconds
+    is the time it took to import the sampling strategy in this backend.
+
+    Strategies that keep a weighted sample list answer_from_sample, which can
+    be updated to answer queries from the sample for the rest of the session.
     """
 
     def execute(self, quals, columns, sortkeys=None):
         # type: (List[Qual], List[str], List[SortKey]) -> Iterable[Any]
         """Fetches metadata about all of the active SamplingFdws"""
         for name, sampling_fdw in SamplingFdw.registry.items():
-            yield {
+            metadata = sampling_fdw.sampling_strategy.metadata()
+            metadata["strategy_import_seconds"] = (
+                SamplingStrategyRegistry.import_times.get(
+                    sampling_fdw.strategy_name))
+            if sampling_fdw.replica_pool is not None:
+                metadata.update(sampling_fdw.replica_pool.metadata())
+            if sampling_fdw.router is not None:
+                metadata["routed_locally"] = sampling_fdw.router.routed[LOCAL]
+                metadata["routed_remotely"] = (
+                    sampling_fdw.router.routed[REMOTE])
+            metadata.update({
                 "name": name,
                 "table_name": sampling_fdw.table_name,
                 "rows_stored_locally": sampling_fdw.rows_stored_locally
-            }
+            })
+            yield metadata
 
     @property
     def rowid_column(self):  # type: () -> str
@@ -272,19 +828,38 @@ class MetadataFdw(ForeignDataWrapper):
         rows_stored_locally, which notifies the sampling strategy that it
         should request more rows from the remote database and store them in the
         local database.
+
+        It also allows users to update answer_from_sample for sampling
+        strategies that list it.
         """
         for key in oldvalues:
             if (oldvalues[key] != newvalues[key] and
-                    key != "rows_stored_locally"):
+                    key not in ["rows_stored_locally", "answer_from_sample"]):
                 log_to_postgres(
-                    "The only column that can be modified in this FDW is rows_stored_locally",
+                    "The only columns that can be modified in this FDW are rows_stored_locally and answer_from_sample",
                     logging.ERROR)
 
         sampling_fdw = SamplingFdw.registry[oldvalues["name"]]
+        if oldvalues.get("answer_from_sample") != newvalues.get(
+                "answer_from_sample"):
+            if "answer_from_sample" not in (
+                    sampling_fdw.sampling_strategy.metadata()):
+                log_to_postgres(
+                    "The sampling strategy of {} does not keep a weighted sample".
+                    format(oldvalues["name"]), logging.ERROR)
+            sampling_fdw.sampling_strategy.answer_from_sample = bool(
+                newvalues["answer_from_sample"])
+            # Cached rows were read from the other source
+            if sampling_fdw.row_cache is not None:
+                sampling_fdw.row_cache.clear()
+            if sampling_fdw.negative_cache is not None:
+                sampling_fdw.negative_cache.clear()
+
         oldcount = oldvalues["rows_stored_locally"]
         newcount = newvalues["rows_stored_locally"]
-        with sampling_fdw.remote_connection, sampling_fdw.local_connection:
-            remote_cursor = sampling_fdw.remote_connection.cursor()
+        read_connection = sampling_fdw.read_connection
+        with read_connection, sampling_fdw.local_connection:
+            remote_cursor = read_connection.cursor()
             local_cursor = sampling_fdw.local_connection.cursor()
             sampling_fdw.rows_stored_locally = (
                 sampling_fdw.sampling_strategy.fetch_more_rows(
@@ -0,0 +1,54 @@
+import math
+from typing import Hashable, Iterable
+
+
+class BloomFilter(object):
+    """A compact set membership structure that can have false positives, but
+    no false negatives.
+
+    The filter is sized so that the false positive rate stays below error_rate
+    while it holds at most capacity keys. Keys cannot be removed, so a filter
+    should be rebuilt once many of its keys have been removed or once it holds
+    more than capacity keys.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        # type: (int, float) -> None
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.num_bits = int(
+            math.ceil(-self.capacity * math.log(error_rate) / math.log(2)**2))
+        self.num_hashes = max(
+            1, int(round(self.num_bits / float(self.capacity) * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key):  # type: (Hashable) -> Iterable[int]
+        """Returns the bit positions for the supplied key, using double
+        hashing.
+        """
+        first = hash(key)
+        second = hash((key, self.num_bits)) | 1
+        for i in range(self.num_hashes):
+            yield (first + i * second) % self.num_bits
+
+    def add(self, key):  # type: (Hashable) -> None
+        """Adds the supplied key to the filter."""
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, keys):  # type: (Iterable[Hashable]) -> None
+        """Adds every supplied key to the filter."""
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key):  # type: (Hashable) -> bool
+        """Returns False if the key was certainly never added to the filter."""
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+    @property
+    def full(self):  # type: () -> bool
+        """True if the filter holds more keys than it was sized for."""
+        return self.count > self.capacity
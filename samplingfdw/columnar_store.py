@@ -0,0 +1,252 @@
+import errno
+import fcntl
+from multicorn import ColumnDefinition, Qual, ANY
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from samplingfdw.quals import OPERATORS, null_test
+
+# Imported by import_numpy when the first ColumnarStore is created, so that
+# backends that do not use the columnar local store do not pay for importing it
+numpy = None  # type: Any
+
+INTEGER_TYPES = ["smallint", "integer", "bigint", "serial", "bigserial"]
+# numeric and decimal are not stored, as float64 would lose their precision
+FLOAT_TYPES = ["real", "double precision"]
+STRING_TYPES = ["text", "character varying", "varchar", "character", "char"]
+
+
+def import_numpy():  # type: () -> None
+    """Imports numpy, raising ImportError if it is not installed."""
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as numpy_module
+        except ImportError:
+            raise ImportError(
+                "numpy is required for the columnar local store")
+        numpy = numpy_module
+
+
+def column_dtype(column):  # type: (ColumnDefinition) -> Optional[str]
+    """Returns the NumPy type used to store the supplied column, or None if
+    the column cannot be stored in a memory-mapped column file.
+    """
+    type_name = (column.base_type_name or column.type_name).split("(")[0]
+    type_name = type_name.strip().lower()
+    if type_name in INTEGER_TYPES:
+        return "int64"
+    if type_name in FLOAT_TYPES:
+        return "float64"
+    if type_name == "boolean":
+        return "bool"
+    if type_name in STRING_TYPES:
+        return "str"
+    return None
+
+
+class ColumnarStore(object):
+    """A read-only copy of a local table, stored as one memory-mapped NumPy
+    file per column so that it can be shared by every backend.
+
+    The local table holds the stored_columns of the foreign table, which
+    default to all of its columns. Columns whose type has no fixed-size NumPy
+    equivalent are not copied, and queries requesting them are not answered.
+
+    Every copy is written to a new generation directory under path, and the
+    name of the current generation is kept in path/CURRENT with the version of
+    the local table it was copied from, so readers never see a partially
+    written copy. Writers hold a lock on path/LOCK, so only one copy is
+    written at a time, and a copy never replaces one of a later version.
+    Each column also has a boolean file marking its NULL values.
+    """
+
+    def __init__(self, path, columns, stored_columns=None):
+        # type: (str, Dict[str, ColumnDefinition], Optional[List[str]]) -> None
+        import_numpy()
+        self.path = path
+        self.column_names = list(columns)
+        self.stored_columns = (list(columns) if stored_columns is None else
+                               stored_columns)
+        self.dtypes = {}  # type: Dict[str, str]
+        for name in self.stored_columns:
+            dtype = column_dtype(columns[name])
+            if dtype is not None:
+                self.dtypes[name] = dtype
+        self.generation = None  # type: Optional[str]
+        self._arrays = {}  # type: Dict[str, Any]
+        self._nulls = {}  # type: Dict[str, Any]
+
+    @property
+    def _current_path(self):  # type: () -> str
+        return os.path.join(self.path, "CURRENT")
+
+    def _read_current(self):  # type: () -> Optional[Tuple[str, int]]
+        """Returns the name and version of the current generation, or None if
+        there is none.
+        """
+        try:
+            with open(self._current_path) as f:
+                current = f.read().split()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        if len(current) != 2:
+            return None
+        return current[0], int(current[1])
+
+    def is_valid(self, version):  # type: (int) -> bool
+        """Returns True if the current copy was made from the supplied version
+        of the local table, loading it if it was written since the last call.
+        """
+        current = self._read_current()
+        if current is None or current[1] != version:
+            return False
+        generation = current[0]
+        if generation != self.generation:
+            directory = os.path.join(self.path, generation)
+            try:
+                self._arrays = {
+                    name: numpy.load(
+                        os.path.join(directory, name + ".npy"), mmap_mode="r")
+                    for name in self.dtypes
+                }
+                self._nulls = {
+                    name: numpy.load(
+                        os.path.join(directory, name + ".null.npy"),
+                        mmap_mode="r")
+                    for name in self.dtypes
+                }
+            except IOError:
+                # The generation was removed by a concurrent writer
+                self.generation = None
+                self._arrays = {}
+                self._nulls = {}
+                return False
+            self.generation = generation
+        return True
+
+    def write(self, rows, version):  # type: (Iterable[Any], int) -> None
+        """Writes a new copy from the supplied rows of the supplied version of
+        the local table, which hold a value for every stored column in
+        declaration order, and makes it current.
+
+        Nothing is written if the current copy is of the same or a later
+        version.
+        """
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        with open(os.path.join(self.path, "LOCK"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                current = self._read_current()
+                if current is None or current[1] < version:
+                    self._write_generation(rows, version)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_generation(self, rows, version):
+        # type: (Iterable[Any], int) -> None
+        """Writes a new generation and makes it current. The caller holds the
+        lock, so every other generation is out of date and is removed.
+        """
+        values = {name: [] for name in self.dtypes}  # type: Dict[str, List[Any]]
+        indexes = [(name, self.stored_columns.index(name))
+                   for name in self.dtypes]
+        for row in rows:
+            for name, index in indexes:
+                values[name].append(row[index])
+
+        directory = tempfile.mkdtemp(prefix="generation-", dir=self.path)
+        for name, dtype in self.dtypes.items():
+            nulls = numpy.array([value is None for value in values[name]],
+                                dtype="bool")
+            fill = "" if dtype == "str" else 0
+            array = numpy.array(
+                [fill if value is None else value for value in values[name]],
+                dtype=dtype)
+            numpy.save(os.path.join(directory, name + ".npy"), array)
+            numpy.save(os.path.join(directory, name + ".null.npy"), nulls)
+
+        current_path = os.path.join(directory, "CURRENT")
+        with open(current_path, "w") as f:
+            f.write("{} {}".format(os.path.basename(directory), version))
+        os.rename(current_path, self._current_path)
+        for entry in os.listdir(self.path):
+            if entry.startswith("generation-") and entry != os.path.basename(
+                    directory):
+                # Backends that still map the old files keep their contents
+                shutil.rmtree(os.path.join(self.path, entry), True)
+
+    def _mask(self, qual):  # type: (Qual) -> Any
+        """Returns a boolean mask of the rows satisfying the supplied qual,
+        or None if it cannot be evaluated on the column files.
+        """
+        if qual.field_name not in self._arrays:
+            return None
+        array = self._arrays[qual.field_name]
+        nulls = self._nulls[qual.field_name]
+        try:
+            if qual.is_list_operator:
+                compare = OPERATORS.get(qual.operator[0])
+                if compare is None or not qual.value:
+                    return None
+                masks = [compare(array, value) for value in qual.value]
+                if qual.list_any_or_all == ANY:
+                    mask = numpy.logical_or.reduce(masks)
+                else:
+                    mask = numpy.logical_and.reduce(masks)
+            elif qual.value is None:
+                is_null = null_test(qual)
+                if is_null is None:
+                    return None
+                return numpy.array(nulls) if is_null else ~nulls
+            else:
+                compare = OPERATORS.get(qual.operator)
+                if compare is None:
+                    return None
+                mask = compare(array, qual.value)
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(mask, numpy.ndarray):
+            return None
+        return mask & ~nulls
+
+    def fetch(self, quals, columns):
+        # type: (List[Qual], Iterable[str]) -> Optional[List[Any]]
+        """Returns the rows satisfying the supplied quals as sequences holding
+        a value for every column in declaration order, with None for columns
+        that were not requested.
+
+        Returns None if a requested column is not stored, or a qual cannot be
+        evaluated on the column files.
+        """
+        columns = set(columns)
+        if not self._arrays or not columns.issubset(self._arrays):
+            return None
+        num_rows = len(next(iter(self._arrays.values())))
+        mask = numpy.ones(num_rows, dtype="bool")
+        for qual in quals:
+            qual_mask = self._mask(qual)
+            if qual_mask is None:
+                return None
+            mask &= qual_mask
+
+        num_selected = int(mask.sum())
+        column_values = []
+        for name in self.column_names:
+            if name not in columns:
+                column_values.append([None] * num_selected)
+                continue
+            selected = self._arrays[name][mask].tolist()
+            for index in numpy.flatnonzero(self._nulls[name][mask]):
+                selected[index] = None
+            column_values.append(selected)
+        return list(zip(*column_values))
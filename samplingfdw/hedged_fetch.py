@@ -0,0 +1,59 @@
+import psycopg2
+import threading
+from typing import Any, Callable, Iterable, List, Optional
+
+
+class HedgedFetch(object):
+    """Runs a remote fetch on a worker thread while the local database is
+    queried, so that a local miss does not pay both latencies in sequence.
+
+    The remote query starts after delay seconds, unless the fetch is cancelled
+    first. Cancelling a running query uses connection.cancel(), so the
+    supplied connection must not be used by any other thread until the fetch
+    is finished.
+    """
+
+    def __init__(self, connection, fetch, delay=0):
+        # type: (psycopg2.connection, Callable[[psycopg2.cursor], Iterable[Any]], float) -> None
+        self.connection = connection
+        self.rows = None  # type: Optional[List[Any]]
+        self.error = None  # type: Optional[Exception]
+        self._fetch = fetch
+        self._delay = delay
+        self._start = threading.Event()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):  # type: () -> None
+        if self._delay > 0:
+            self._start.wait(self._delay)
+        if self._cancelled.is_set():
+            return
+        try:
+            with self.connection:
+                self.rows = list(self._fetch(self.connection.cursor()))
+        except Exception as e:
+            # Raised by result() in the thread that waits for the rows
+            self.error = e
+
+    def cancel(self):  # type: () -> None
+        """Stops the remote fetch, cancelling the remote query if it is
+        running, and waits for the worker thread to finish.
+        """
+        self._cancelled.set()
+        self._start.set()
+        while self._thread.is_alive():
+            self.connection.cancel()
+            self._thread.join(0.01)
+
+    def result(self):  # type: () -> List[Any]
+        """Starts the remote fetch if it is still waiting for its delay, waits
+        for it to finish and returns its rows.
+        """
+        self._start.set()
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.rows
@@ -0,0 +1,161 @@
+import collections
+import hashlib
+from multicorn import Qual, ANY
+import psycopg2
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# The multicorn operators that a btree index can be used for.
+BTREE_OPERATORS = ["=", "<", "<=", ">", ">="]
+
+
+class IndexAdvisor(object):
+    """Records which columns of a local table are used in the quals of queries
+    answered locally, and maintains btree indexes on them.
+
+    Once a column has been used in threshold quals, an index is created on it.
+    Indexes created by the advisor that are not scanned for unused_seconds are
+    dropped again. Both happen on a background thread with its own
+    autocommit connection, so they never run in the query path.
+
+    Partitioned tables support neither CREATE INDEX CONCURRENTLY nor scan
+    statistics on their own indexes, so for them the advisor is created with
+    partitioned set to True, and indexes are built without CONCURRENTLY and
+    never dropped.
+    """
+
+    def __init__(self,
+                 table_name,
+                 local_options,
+                 threshold=100,
+                 unused_seconds=86400.0,
+                 partitioned=False):
+        # type: (str, Dict[str, str], int, float, bool) -> None
+        self.table_name = table_name
+        self.local_options = local_options
+        self.threshold = threshold
+        self.unused_seconds = unused_seconds
+        self.partitioned = partitioned
+        self.indexes = set()  # type: Set[str]
+        self.errors = 0
+        self.counts = collections.Counter()  # type: collections.Counter
+        self._last_check = time.time()
+        # Maps index names to their last seen scan count and when it changed
+        self._scans = {}  # type: Dict[str, List[float]]
+        self._pending = set()  # type: Set[str]
+        self._queue = queue.Queue()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def index_name(self, column):  # type: (str) -> str
+        """Returns the name of the index the advisor creates on a column.
+
+        Postgres truncates names to 63 bytes, so the name holds a hash of the
+        table and column names instead of the names themselves.
+        """
+        return "{}_auto_{}_idx".format(
+            self.table_name[:36],
+            hashlib.md5("{}.{}".format(self.table_name, column).encode(
+                "utf-8")).hexdigest()[:12])
+
+    def load_indexes(self, cursor):  # type: (psycopg2.cursor) -> None
+        """Loads the indexes that were created by the advisor in earlier
+        sessions or other backends.
+        """
+        cursor.execute(
+            "SELECT c.relname, a.attname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0] WHERE i.indrelid = to_regclass(%s)",
+            (self.table_name, ))
+        for index_name, column in cursor.fetchall():
+            if index_name == self.index_name(column):
+                self.indexes.add(column)
+
+    def observe(self, quals):  # type: (List[Qual]) -> None
+        """Records the supplied quals of a query answered locally, and
+        schedules indexes to be created or dropped if needed.
+        """
+        for qual in quals:
+            operator = qual.operator
+            if qual.is_list_operator:
+                if qual.list_any_or_all != ANY:
+                    continue
+                operator = operator[0]
+            if operator not in BTREE_OPERATORS or qual.value is None:
+                continue
+            self.counts[qual.field_name] += 1
+            if (self.counts[qual.field_name] >= self.threshold and
+                    qual.field_name not in self.indexes and
+                    qual.field_name not in self._pending):
+                self._schedule(qual.field_name)
+        if (not self.partitioned and
+                time.time() - self._last_check >= self.unused_seconds):
+            self._last_check = time.time()
+            self._schedule(None)
+
+    def _schedule(self, column):  # type: (Optional[str]) -> None
+        """Schedules an index to be created on the supplied column, or a check
+        for unused indexes if column is None.
+        """
+        if column is not None:
+            self._pending.add(column)
+        self._queue.put(column)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):  # type: () -> None
+        """Creates indexes and drops unused ones as they are scheduled."""
+        connection = None
+        while True:
+            column = self._queue.get()
+            try:
+                if connection is None:
+                    connection = psycopg2.connect(**self.local_options)
+                    connection.autocommit = True
+                cursor = connection.cursor()
+                if column is None:
+                    self.drop_unused_indexes(cursor)
+                else:
+                    self.create_index(cursor, column)
+            except psycopg2.Error:
+                self.errors += 1
+            finally:
+                self._pending.discard(column)
+
+    def create_index(self, cursor, column):
+        # type: (psycopg2.cursor, str) -> None
+        """Creates a btree index on the supplied column."""
+        cursor.execute("CREATE INDEX {}IF NOT EXISTS {} ON {} ({})".format(
+            "" if self.partitioned else "CONCURRENTLY ",
+            self.index_name(column), self.table_name, column))
+        self.indexes.add(column)
+        self._scans[self.index_name(column)] = [0, time.time()]
+
+    def drop_unused_indexes(self, cursor):  # type: (psycopg2.cursor) -> None
+        """Drops the indexes created by the advisor whose scan count has not
+        changed for unused_seconds.
+        """
+        cursor.execute(
+            "SELECT indexrelname, idx_scan FROM pg_stat_user_indexes WHERE relname = %s",
+            (self.table_name, ))
+        scans = dict(cursor.fetchall())
+        now = time.time()
+        for column in list(self.indexes):
+            index_name = self.index_name(column)
+            if index_name not in scans:
+                self.indexes.discard(column)
+                continue
+            last_scans, changed_at = self._scans.get(index_name, [-1, now])
+            if scans[index_name] != last_scans:
+                self._scans[index_name] = [scans[index_name], now]
+            elif now - changed_at >= self.unused_seconds:
+                cursor.execute(
+                    "DROP INDEX CONCURRENTLY IF EXISTS {}".format(index_name))
+                self.indexes.discard(column)
+                self.counts[column] = 0
+                del self._scans[index_name]
@@ -0,0 +1,110 @@
+import collections
+from multicorn import Qual, ANY
+import time
+from typing import Any, Dict, FrozenSet, Hashable, List, Optional
+
+from samplingfdw.quals import OPERATORS, null_test
+
+
+def normalize_quals(quals):  # type: (List[Qual]) -> FrozenSet[Hashable]
+    """Returns a hashable representation of the supplied quals that does not
+    depend on their order.
+    """
+    return frozenset(
+        (qual.field_name, qual.operator,
+         tuple(qual.value) if isinstance(qual.value, list) else qual.value)
+        for qual in quals)
+
+
+def qual_may_match(qual, values):  # type: (Qual, Dict[str, Any]) -> bool
+    """Returns False if a row with the supplied values certainly does not
+    satisfy the supplied qual, and True otherwise.
+    """
+    if qual.field_name not in values:
+        return True
+    value = values[qual.field_name]
+    if qual.is_list_operator:
+        compare = OPERATORS.get(qual.operator[0])
+        if compare is None or value is None:
+            return True
+        try:
+            matches = [compare(value, qual_value) for qual_value in qual.value]
+        except TypeError:
+            return True
+        return any(matches) if qual.list_any_or_all == ANY else all(matches)
+    if qual.value is None:
+        is_null = null_test(qual)
+        return is_null is None or is_null == (value is None)
+    compare = OPERATORS.get(qual.operator)
+    if compare is None:
+        return True
+    if value is None:
+        return False
+    try:
+        return compare(value, qual.value)
+    except TypeError:
+        return True
+
+
+class NegativeCache(object):
+    """A bounded cache of qual sets for which the remote database returned no
+    rows.
+
+    Entries expire ttl seconds after they were stored, if ttl is not None, and
+    are removed when a row that could satisfy their quals is written.
+    """
+
+    def __init__(self, size, ttl=None):
+        # type: (int, Optional[float]) -> None
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        # Maps normalized quals to a (quals, expiry time) tuple, oldest first.
+        self._entries = collections.OrderedDict(
+        )  # type: Dict[FrozenSet[Hashable], Any]
+
+    def __len__(self):  # type: () -> int
+        return len(self._entries)
+
+    def __contains__(self, quals):  # type: (List[Qual]) -> bool
+        """Returns True if the supplied quals are known to select no rows."""
+        key = normalize_quals(quals)
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        if entry[1] is not None and entry[1] < time.time():
+            del self._entries[key]
+            return False
+        self.hits += 1
+        return True
+
+    def covers(self, quals):  # type: (List[Qual]) -> bool
+        """Returns True if the supplied quals are known to select no rows,
+        without counting as a hit or removing expired entries.
+        """
+        entry = self._entries.get(normalize_quals(quals))
+        return entry is not None and (entry[1] is None or
+                                      entry[1] >= time.time())
+
+    def add(self, quals):  # type: (List[Qual]) -> None
+        """Records that the supplied quals select no rows, evicting the oldest
+        entry if the cache is full.
+        """
+        key = normalize_quals(quals)
+        self._entries.pop(key, None)
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (list(quals), expires)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, values):  # type: (Dict[str, Any]) -> None
+        """Removes every entry whose quals could be satisfied by a row with
+        the supplied values.
+        """
+        for key, (quals, _) in list(self._entries.items()):
+            if all(qual_may_match(qual, values) for qual in quals):
+                del self._entries[key]
+
+    def clear(self):  # type: () -> None
+        """Removes every entry."""
+        self._entries.clear()
@@ -0,0 +1,178 @@
+import collections
+import psycopg2
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Set
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class Prefetcher(object):
+    """Predicts which values of a column will be requested next from the
+    stream of requested values, and fills them into the local database on a
+    background thread before they are requested.
+
+    Two predictions are made for every requested value:
+      * the values most frequently requested right after it, and
+      * for integer values, the next value in an arithmetic progression, if the
+        previous two requests formed one.
+
+    Once max_values values are prefetched, the value prefetched first is
+    removed with the supplied evict function before another one is filled.
+
+    The supplied fill function is called on the background thread with cursors
+    to the remote and local database, which are owned by that thread, and
+    returns the number of rows stored locally, or None if the value was
+    skipped. A value is only added to prefetched once its rows are committed
+    to the local database. The supplied remote_options function is called
+    before each fill with the connection parameters of the current remote
+    connection, or None, and the thread reconnects if it returns others. To avoid starving foreground
+    queries, the thread sleeps after each fill for as long as it takes to stay
+    under rows_per_second.
+    """
+
+    def __init__(self,
+                 fill,
+                 evict,
+                 local_options,
+                 remote_options,
+                 rows_per_second=1000.0,
+                 max_values=100,
+                 num_successors=2):
+        # type: (Callable[[psycopg2.cursor, psycopg2.cursor, Hashable], Optional[int]], Callable[[psycopg2.cursor, psycopg2.cursor, Hashable], None], Dict[str, str], Callable[[Optional[Dict[str, str]]], Dict[str, str]], float, int, int) -> None
+        self.fill = fill
+        self.evict = evict
+        self.local_options = local_options
+        self.remote_options = remote_options
+        self.rows_per_second = rows_per_second
+        self.max_values = max_values
+        self.num_successors = num_successors
+        self.prefetched = set()  # type: Set[Hashable]
+        self.prefetch_count = 0
+        self.prefetched_rows = 0
+        self.hits = 0
+        self.errors = 0
+        self._used = set()  # type: Set[Hashable]
+        self._order = collections.deque()  # type: collections.deque
+        self._previous = []  # type: List[Hashable]
+        self._successors = collections.defaultdict(
+            collections.Counter)  # type: Dict[Hashable, collections.Counter]
+        self._pending = set()  # type: Set[Hashable]
+        self._queue = queue.Queue(maxsize=16)
+        self._thread = None  # type: Optional[threading.Thread]
+
+    @property
+    def hit_rate(self):  # type: () -> float
+        """The fraction of prefetched values that were later requested."""
+        if not self.prefetch_count:
+            return 0.0
+        return float(self.hits) / self.prefetch_count
+
+    def discard(self, value):  # type: (Hashable) -> None
+        """Forgets the supplied prefetched value, whose rows are no longer
+        stored locally.
+        """
+        self.prefetched.discard(value)
+        self._used.discard(value)
+        try:
+            self._order.remove(value)
+        except ValueError:
+            pass
+
+    def record_hit(self, value):  # type: (Hashable) -> None
+        """Records that a query for the supplied value was answered locally."""
+        if value in self.prefetched and value not in self._used:
+            self._used.add(value)
+            self.hits += 1
+
+    def predict(self, value):  # type: (Hashable) -> List[Hashable]
+        """Returns the values predicted to be requested after the supplied
+        value.
+        """
+        predictions = [
+            successor
+            for successor, count in self._successors[value].most_common(
+                self.num_successors) if count > 1
+        ]
+        if len(self._previous) == 2 and all(
+                isinstance(previous, int) for previous in self._previous):
+            step = self._previous[1] - self._previous[0]
+            if step != 0 and isinstance(value, int) and (
+                    value - self._previous[1] == step):
+                predictions.append(value + step)
+        return predictions
+
+    def observe(self, value, is_cached):
+        # type: (Hashable, Callable[[Hashable], bool]) -> None
+        """Records a request for the supplied value, and schedules the
+        predicted next values that are not prefetched already, and for which
+        is_cached returns False, to be prefetched.
+        """
+        if self._previous:
+            self._successors[self._previous[-1]][value] += 1
+        for prediction in self.predict(value):
+            if (prediction in self.prefetched or is_cached(prediction) or
+                    prediction in self._pending or
+                    len(self._pending) >= self.max_values):
+                continue
+            try:
+                self._queue.put_nowait(prediction)
+            except queue.Full:
+                break
+            self._pending.add(prediction)
+        self._previous = (self._previous + [value])[-2:]
+        if self._pending and self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):  # type: () -> None
+        """Fills predicted values as they are scheduled."""
+        local_connection = None
+        remote_connection = None
+        connected_options = None  # type: Optional[Dict[str, str]]
+        while True:
+            value = self._queue.get()
+            try:
+                if local_connection is None:
+                    local_connection = psycopg2.connect(**self.local_options)
+                options = self.remote_options(connected_options)
+                if remote_connection is None or options != connected_options:
+                    if remote_connection is not None:
+                        remote_connection.close()
+                    remote_connection = psycopg2.connect(**options)
+                    connected_options = options
+                if len(self.prefetched) >= self.max_values:
+                    self._evict_oldest(remote_connection, local_connection)
+                with remote_connection, local_connection:
+                    rows = self.fill(remote_connection.cursor(),
+                                     local_connection.cursor(), value)
+            except psycopg2.Error:
+                self.errors += 1
+                rows = 0
+            else:
+                if rows is not None:
+                    self.prefetched.add(value)
+                    self._order.append(value)
+                    self.prefetch_count += 1
+                    self.prefetched_rows += rows
+            finally:
+                self._pending.discard(value)
+            if rows and self.rows_per_second > 0:
+                time.sleep(rows / self.rows_per_second)
+
+    def _evict_oldest(self, remote_connection, local_connection):
+        # type: (psycopg2.connection, psycopg2.connection) -> None
+        """Evicts the value that was prefetched first.
+
+        The value stops being answered locally before its rows are removed.
+        """
+        value = self._order.popleft()
+        self.prefetched.discard(value)
+        self._used.discard(value)
+        with remote_connection, local_connection:
+            self.evict(remote_connection.cursor(), local_connection.cursor(),
+                       value)
@@ -0,0 +1,29 @@
+from multicorn import Qual
+import operator
+from typing import Any, Callable, Dict, Optional
+
+# Maps the multicorn operators that can be evaluated in Python to functions
+# comparing a column value to a qual value.
+OPERATORS = {
+    "=": operator.eq,
+    "<>": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}  # type: Dict[str, Callable[[Any, Any], bool]]
+
+
+def null_test(qual):  # type: (Qual) -> Optional[bool]
+    """Returns True if the supplied qual is an IS NULL test, False if it is an
+    IS NOT NULL test, and None otherwise.
+
+    multicorn represents IS NULL and IS NOT NULL as comparisons with None.
+    """
+    if qual.is_list_operator or qual.value is not None:
+        return None
+    if qual.operator == "=":
+        return True
+    if qual.operator == "<>":
+        return False
+    return None
@@ -0,0 +1,156 @@
+import collections
+from multicorn import Qual
+from typing import Dict, FrozenSet, Hashable, Iterable, List, Optional, Tuple
+
+LOCAL = "local"
+REMOTE = "remote"
+
+
+class SourceStats(object):
+    """Exponentially weighted moving averages of the queries of one shape
+    answered by one source.
+    """
+
+    def __init__(self):  # type: () -> None
+        self.latency = None  # type: Optional[float]
+        self.rows = None  # type: Optional[float]
+        # The fraction of attempts that the source could answer, which is
+        # below 1 for the local database when the sampling strategy misses
+        self.hit_rate = 1.0
+
+    def record_latency(self, seconds, weight):
+        # type: (float, float) -> None
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += weight * (seconds - self.latency)
+
+    def record_rows(self, rows, weight):  # type: (int, float) -> None
+        if self.rows is None:
+            self.rows = float(rows)
+        else:
+            self.rows += weight * (rows - self.rows)
+
+
+class QueryRouter(object):
+    """Decides whether a query is first tried on the local database, as
+    SamplingFdw does by default, or sent straight to the remote database.
+
+    Queries are grouped by shape: the columns and operators of their quals and
+    their requested columns. For every shape and source, the router keeps
+    moving averages of the latency of the fetch and the number of rows
+    returned, and for the local database, of how often the sampling strategy
+    could answer the query. Trying the local database first is estimated to
+    cost its latency plus, when it misses, the remote latency, and the
+    cheaper of that and the remote latency is chosen.
+
+    A source that has not answered a shape yet is estimated from the
+    expected number of rows and the average time per row of that source over
+    all shapes. Every explore_every-th query of a shape goes to the source
+    that was not chosen, so both estimates follow changes in the databases.
+    Only the choice of which source to try first is made here; the remote
+    database can always answer correctly.
+
+    Latencies are recorded as soon as a fetch completes, while row counts are
+    only known once all rows were read, so scans that stop early, as with
+    LIMIT, do not update them.
+    """
+
+    def __init__(self, explore_every=20, weight=0.2):
+        # type: (int, float) -> None
+        self.explore_every = explore_every
+        self.weight = weight
+        self.stats = collections.defaultdict(
+            dict)  # type: Dict[Hashable, Dict[str, SourceStats]]
+        self.counts = collections.Counter()  # type: collections.Counter
+        # The average seconds per returned row of each source over all shapes
+        self.seconds_per_row = {}  # type: Dict[str, float]
+        self.routed = collections.Counter()  # type: collections.Counter
+
+    @staticmethod
+    def shape(quals, columns):
+        # type: (List[Qual], Iterable[str]) -> Tuple[FrozenSet[Tuple[str, str]], FrozenSet[str]]
+        """Returns the shape of a query, which ignores the values of its
+        quals.
+        """
+        return (frozenset((qual.field_name, str(qual.operator))
+                          for qual in quals), frozenset(columns))
+
+    def _estimate(self, shape, source):
+        # type: (Hashable, str) -> Optional[float]
+        """Returns the estimated latency of a fetch of the supplied shape
+        from the supplied source, or None if there is nothing to base it on.
+        """
+        stats = self.stats[shape].get(source)
+        if stats is not None and stats.latency is not None:
+            return stats.latency
+        if source not in self.seconds_per_row:
+            return None
+        rows = [
+            other.rows for other in self.stats[shape].values()
+            if other.rows is not None
+        ]
+        if not rows:
+            return None
+        return max(rows) * self.seconds_per_row[source]
+
+    def estimate(self, shape):
+        # type: (Hashable) -> Tuple[str, Optional[float], Optional[float]]
+        """Returns the source that is cheaper for the supplied shape, with the
+        estimated cost of trying the local database first and of going
+        straight to the remote database, which are None if unknown.
+        """
+        local = self._estimate(shape, LOCAL)
+        remote = self._estimate(shape, REMOTE)
+        if local is None or remote is None:
+            return LOCAL, local, remote
+        local_stats = self.stats[shape].get(LOCAL)
+        hit_rate = local_stats.hit_rate if local_stats is not None else 1.0
+        local_first = local + (1.0 - hit_rate) * remote
+        return (LOCAL if local_first <= remote else REMOTE), local_first, remote
+
+    def route(self, shape):  # type: (Hashable) -> str
+        """Returns the source that a query of the supplied shape should be
+        tried on first.
+        """
+        source = self.estimate(shape)[0]
+        self.counts[shape] += 1
+        if self.explore_every > 0 and (
+                self.counts[shape] % self.explore_every == 0):
+            source = REMOTE if source == LOCAL else LOCAL
+        self.routed[source] += 1
+        return source
+
+    def _source_stats(self, shape, source):
+        # type: (Hashable, str) -> SourceStats
+        stats = self.stats[shape].get(source)
+        if stats is None:
+            stats = self.stats[shape][source] = SourceStats()
+        return stats
+
+    def record(self, shape, source, seconds, answered=True):
+        # type: (Hashable, str, float, bool) -> None
+        """Records a fetch of the supplied shape from the supplied source that
+        took seconds, as soon as it completes. A local fetch that the sampling
+        strategy could not answer is recorded with answered set to False.
+        """
+        stats = self._source_stats(shape, source)
+        if source == LOCAL:
+            stats.hit_rate += self.weight * (float(answered) - stats.hit_rate)
+        # The latency of a miss is paid by every local attempt, so it is
+        # recorded too
+        stats.record_latency(seconds, self.weight)
+
+    def record_rows(self, shape, source, seconds, rows):
+        # type: (Hashable, str, float, int) -> None
+        """Records that a fetch of the supplied shape from the supplied source
+        that took seconds returned rows rows, once all of them were read.
+        """
+        self._source_stats(shape, source).record_rows(rows, self.weight)
+        if rows:
+            seconds_per_row = seconds / rows
+            if source not in self.seconds_per_row:
+                self.seconds_per_row[source] = seconds_per_row
+            else:
+                self.seconds_per_row[source] += self.weight * (
+                    seconds_per_row - self.seconds_per_row[source])
@@ -17,15 +17,16 @@ class RemoteSamplingStrategy(SamplingStrategy):
                        This options is required for INSERT, UPDATE and DELETE operations
     """
 
+    sequence_rows = True
+
     def fetch_remotely(self, remote_cursor, quals, columns, sortkeys=None):
         # type: (psycopg2.cursor, List[Qual], List[str], List[SortKey]) -> Iterable[Any]
         """Executes the supplied query against the remote database and returns
         the result.
         """
         self.execute_fetch_statement(remote_cursor, self.table_name, quals,
-                                     columns, sortkeys)
-        for result in remote_cursor:
-            yield dict(zip(columns, result))
+                                     self.select_list(columns), sortkeys)
+        return self.rows(remote_cursor, columns)
 
     @property
     def rowid_column(self):  # type: () -> str
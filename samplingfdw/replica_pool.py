@@ -0,0 +1,216 @@
+import psycopg2
+import random
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+class Replica(object):
+    """A read replica of the remote database, with its health and observed
+    latency.
+    """
+
+    def __init__(self, options):  # type: (Dict[str, str]) -> None
+        self.options = options
+        self.latency = None  # type: Optional[float]
+        self.lag = 0.0
+        self.lag_checked_at = None  # type: Optional[float]
+        self.failed_until = 0.0
+        self._connection = None  # type: psycopg2.connection
+
+    @property
+    def name(self):  # type: () -> str
+        return "{}:{}".format(
+            self.options.get("host", ""), self.options.get("port", ""))
+
+    @property
+    def healthy(self):  # type: () -> bool
+        return time.time() >= self.failed_until
+
+    @property
+    def connection(self):  # type: () -> psycopg2.connection
+        """Returns a connection to the replica."""
+        if self._connection is None or self._connection.closed:
+            self._connection = psycopg2.connect(**self.options)
+        return self._connection
+
+    def mark_failed(self, retry_seconds):  # type: (float) -> None
+        """Stops using the replica for retry_seconds."""
+        self.failed_until = time.time() + retry_seconds
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def record_latency(self, seconds, weight=0.2):
+        # type: (float, float) -> None
+        """Updates the exponentially weighted moving average of the latency
+        of queries against the replica.
+        """
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += weight * (seconds - self.latency)
+
+    def check_lag(self):  # type: () -> float
+        """Queries how many seconds the replica is behind the primary."""
+        with self.connection:
+            cursor = self.connection.cursor()
+            cursor.execute(
+                "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+            )
+            self.lag = float(cursor.fetchone()[0])
+        self.lag_checked_at = time.time()
+        return self.lag
+
+
+class ReplicaPool(object):
+    """Chooses which read replica of the remote database a read is sent to.
+
+    Replicas that failed are skipped for retry_seconds, and, if max_lag is not
+    None, replicas whose replication lag was more than max_lag seconds when it
+    was last checked are skipped. Lag is checked at most every check_interval
+    seconds per replica. Among the remaining replicas, two are picked at random
+    and the one with the lower average latency is chosen, which spreads reads
+    across replicas while favoring fast ones.
+
+    If max_lag is not None, no replica is chosen for max_lag seconds after
+    record_write is called, so that reads see the writes made through the
+    primary.
+    """
+
+    def __init__(self,
+                 replicas,
+                 max_lag=None,
+                 check_interval=10.0,
+                 retry_seconds=30.0):
+        # type: (List[Dict[str, str]], Optional[float], float, float) -> None
+        self.replicas = [Replica(options) for options in replicas]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_seconds = retry_seconds
+        self.primary_until = 0.0
+
+    @classmethod
+    def from_options(cls, options, remote_options):
+        # type: (Dict[str, str], Dict[str, str]) -> Optional[ReplicaPool]
+        """Creates a pool from the remote_replicas option, a comma delimited
+        list of host or host:port entries that share the other connection
+        parameters of the primary remote database.
+
+        Returns None if remote_replicas is not set.
+        """
+        if not options.get("remote_replicas"):
+            return None
+        replicas = []
+        for replica in options["remote_replicas"].split(","):
+            replica_options = dict(remote_options)
+            host, _, port = replica.strip().partition(":")
+            replica_options["host"] = host
+            if port:
+                replica_options["port"] = port
+            replicas.append(replica_options)
+        max_lag = options.get("replica_max_lag")
+        return cls(replicas,
+                   float(max_lag) if max_lag is not None else None,
+                   float(options.get("replica_check_interval", 10)),
+                   float(options.get("replica_retry_seconds", 30)))
+
+    def candidates(self):  # type: () -> List[Replica]
+        """Returns the replicas that are healthy and, as far as is known, not
+        lagging too far behind.
+
+        Replicas that were lagging become candidates again once their lag is
+        due to be checked.
+        """
+        return [
+            replica for replica in self.replicas
+            if replica.healthy and (
+                self.max_lag is None or replica.lag <= self.max_lag or
+                time.time() - replica.lag_checked_at >= self.check_interval)
+        ]
+
+    def record_write(self):  # type: () -> None
+        """Records that a write was sent to the primary."""
+        if self.max_lag is not None:
+            self.primary_until = time.time() + self.max_lag
+
+    @property
+    def reading_from_primary(self):  # type: () -> bool
+        """True while reads go to the primary after a write."""
+        return time.time() < self.primary_until
+
+    def pick(self, exclude=()):  # type: (Iterable[Replica]) -> Optional[Replica]
+        """Picks a replica that is not in exclude without querying any of
+        them, or returns None if no replica can be used.
+        """
+        if self.reading_from_primary:
+            return None
+        return self._pick_from([
+            replica for replica in self.candidates() if replica not in exclude
+        ])
+
+    def checked(self):  # type: () -> List[Replica]
+        """Returns the healthy replicas whose lag was at most max_lag when it
+        was checked less than check_interval seconds ago, without querying
+        any of them.
+
+        Returns no replicas while reads go to the primary after a write, or
+        if max_lag is None.
+        """
+        if self.max_lag is None or self.reading_from_primary:
+            return []
+        now = time.time()
+        return [
+            replica for replica in self.replicas
+            if replica.healthy and replica.lag_checked_at is not None and
+            now - replica.lag_checked_at < self.check_interval and
+            replica.lag <= self.max_lag
+        ]
+
+    def pick_checked(self):  # type: () -> Optional[Replica]
+        """Picks one of the replicas returned by checked, or returns None if
+        there are none.
+        """
+        return self._pick_from(self.checked())
+
+    @staticmethod
+    def _pick_from(candidates):  # type: (List[Replica]) -> Optional[Replica]
+        """Picks the faster of two random replicas from candidates."""
+        if not candidates:
+            return None
+        sample = random.sample(candidates, min(2, len(candidates)))
+        # Replicas without a measured latency are tried first
+        return min(sample, key=lambda replica: replica.latency or 0.0)
+
+    def choose(self):  # type: () -> Optional[Replica]
+        """Picks a replica, connecting to it and checking its lag if it is
+        due, or returns None if no replica can be used.
+
+        Replicas that cannot be connected to, or that lag too far behind, are
+        skipped, and each replica is tried at most once.
+        """
+        tried = []  # type: List[Replica]
+        while True:
+            replica = self.pick(tried)
+            if replica is None:
+                return None
+            tried.append(replica)
+            try:
+                if self.max_lag is not None and (
+                        replica.lag_checked_at is None or
+                        time.time() - replica.lag_checked_at >=
+                        self.check_interval):
+                    if replica.check_lag() > self.max_lag:
+                        continue
+                replica.connection
+            except psycopg2.OperationalError:
+                replica.mark_failed(self.retry_seconds)
+                continue
+            return replica
+
+    def metadata(self):  # type: () -> Dict[str, str]
+        """Returns the state of every replica, for MetadataFdw."""
+        return {
+            "replicas": ",".join(
+                "{}({})".format(replica.name, "healthy" if replica.healthy else
+                                "failed") for replica in self.replicas)
+        }
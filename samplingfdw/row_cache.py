@@ -0,0 +1,93 @@
+import collections
+import time
+from typing import Any, Dict, FrozenSet, Hashable, Iterable, List, Optional, Tuple
+
+
+class RowCache(object):
+    """A bounded LRU cache of rows keyed by primary key.
+
+    Every entry remembers which requested columns the cached row holds values
+    for, so it is only used for queries that request a subset of those columns.
+    Entries expire ttl seconds after they were stored, if ttl is not None.
+    """
+
+    def __init__(self, size, ttl=None):
+        # type: (int, Optional[float]) -> None
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Maps a key to a (row, columns, expiry time) tuple, least recently
+        # used first.
+        self._entries = collections.OrderedDict(
+        )  # type: Dict[Hashable, Tuple[Any, FrozenSet[str], Optional[float]]]
+
+    def __len__(self):  # type: () -> int
+        return len(self._entries)
+
+    def get(self, key, columns):  # type: (Hashable, Iterable[str]) -> Any
+        """Returns the cached row for the supplied key, or None if there is no
+        live entry holding all of the supplied columns.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        row, cached_columns, expires = entry
+        if expires is not None and expires < time.time():
+            self.misses += 1
+            return None
+        self._entries[key] = entry
+        if not cached_columns.issuperset(columns):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row
+
+    def get_many(self, keys, columns):
+        # type: (List[Hashable], Iterable[str]) -> Optional[List[Any]]
+        """Returns the cached rows for all of the supplied keys, or None if
+        any of them is missing.
+        """
+        columns = frozenset(columns)
+        rows = []
+        for key in keys:
+            row = self.get(key, columns)
+            if row is None:
+                return None
+            rows.append(row)
+        return rows
+
+    def count_cached(self, keys, columns):
+        # type: (Iterable[Hashable], Iterable[str]) -> int
+        """Returns how many of the supplied keys have a live entry holding all
+        of the supplied columns, without counting as a use of the entries.
+        """
+        columns = frozenset(columns)
+        now = time.time()
+        count = 0
+        for key in keys:
+            entry = self._entries.get(key)
+            if (entry is not None and entry[1].issuperset(columns) and
+                    (entry[2] is None or entry[2] >= now)):
+                count += 1
+        return count
+
+    def put(self, key, row, columns):
+        # type: (Hashable, Any, Iterable[str]) -> None
+        """Stores a row holding values for the supplied columns, evicting the
+        least recently used entry if the cache is full.
+        """
+        self._entries.pop(key, None)
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (row, frozenset(columns), expires)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):  # type: (Hashable) -> None
+        """Removes the entry for the supplied key, if there is one."""
+        self._entries.pop(key, None)
+
+    def clear(self):  # type: () -> None
+        """Removes every entry."""
+        self._entries.clear()
@@ -1,19 +1,130 @@
 from multicorn import Qual, SortKey, ColumnDefinition
 import psycopg2
-from typing import List, Iterable, Any, Optional, Dict
+from typing import List, Iterable, Any, Optional, Dict, FrozenSet, Tuple
+
+from samplingfdw.replica_pool import ReplicaPool
+
+# The name of an optional column of the foreign table that is not stored in
+# the remote table. It holds the inverse of the probability with which each
+# returned row was included in the rows it was returned from, which is 1 for
+# rows fetched from the remote table.
+SAMPLE_WEIGHT_COLUMN = "_sample_weight"
 
 
 class SamplingStrategy(object):
     """Subclasses of this class can be plugged in to SamplingFdw to determine
     what operations get executed on the local server, and what operations get
     executed on the remote server when a SQL statement is executed on the FDW.
+
+    Rows returned by the fetch functions are dicts mapping column names to
+    values by default. Subclasses that set sequence_rows to True instead return
+    sequences holding a value for every column of the foreign table, in the
+    order the columns were declared, which avoids building a dict per row.
+    The select_list and rows helpers produce rows in the right format.
+
+    If the foreign table declares the SAMPLE_WEIGHT_COLUMN column, select_list
+    fills it in with a weight of 1 unless told otherwise. Strategies that keep
+    a weighted sample store the weight of each row in their local table.
     """
 
+    sequence_rows = False
+
+    # Set by SamplingFdw if the remote database has read replicas
+    replica_pool = None  # type: Optional[ReplicaPool]
+
     def __init__(self, table_name, options, columns):
         # type: (str, Dict[str, str], Dict[str, ColumnDefinition]) -> None
         self.table_name = table_name
         self.options = options
         self.columns = columns
+        self._select_lists = {
+        }  # type: Dict[Tuple[FrozenSet[str], str], List[str]]
+
+    def select_list(self, columns, sample_weight="1.0"):
+        # type: (Iterable[str], str) -> List[str]
+        """Returns the expressions to select in a fetch statement for the
+        supplied requested columns.
+
+        If sequence_rows is set, every column of the foreign table is selected
+        in declaration order, with columns that were not requested replaced by
+        NULL, so the rows of the cursor can be returned as they are.
+        The SAMPLE_WEIGHT_COLUMN column is replaced by the supplied
+        sample_weight expression.
+        The select lists are cached per set of requested columns.
+        """
+        if not self.sequence_rows:
+            return [
+                sample_weight if column == SAMPLE_WEIGHT_COLUMN else column
+                for column in columns
+            ]
+        key = (frozenset(columns), sample_weight)
+        select_list = self._select_lists.get(key)
+        if select_list is None:
+            select_list = [
+                (sample_weight if column == SAMPLE_WEIGHT_COLUMN else column)
+                if column in key[0] else "NULL" for column in self.columns
+            ]
+            self._select_lists[key] = select_list
+        return select_list
+
+    def rows(self, cursor, columns):
+        # type: (psycopg2.cursor, Iterable[str]) -> Iterable[Any]
+        """Returns the rows of a fetch statement executed with the select list
+        for the supplied columns, in the format expected by SamplingFdw.
+        """
+        if self.sequence_rows:
+            return iter(cursor)
+        return (dict(zip(columns, result)) for result in cursor)
+
+    @staticmethod
+    def connection_options(options, prefix):
+        # type: (Dict[str, str], str) -> Dict[str, str]
+        """Returns the psycopg2 connection parameters in the supplied options
+        that start with prefix, such as "local_" or "remote_".
+        """
+        return {
+            connection_param: options[prefix + connection_param]
+            for connection_param in ["dbname", "user", "password", "host",
+                                     "port"]
+            if prefix + connection_param in options
+        }
+
+    def read_connection_options(self, current=None):
+        # type: (Optional[Dict[str, str]]) -> Dict[str, str]
+        """Returns the connection parameters that a connection used only for
+        reads from the remote database should use.
+
+        This is a read replica whose lag was checked recently and found to be
+        at most replica_max_lag, as the rows read may be kept locally, and the
+        primary remote database otherwise. Lag is not checked here, as this
+        may be called from background threads, so only replicas checked by
+        foreground reads are used.
+
+        Long-lived connections pass the parameters they were opened with as
+        current, which are returned unchanged while they are still usable, and
+        reconnect whenever the returned parameters differ.
+        """
+        if self.replica_pool is not None:
+            checked = self.replica_pool.checked()
+            for replica in checked:
+                if replica.options == current:
+                    return current
+            replica = self.replica_pool.pick_checked()
+            if replica is not None:
+                return replica.options
+        return self.connection_options(self.options, "remote_")
+
+    @staticmethod
+    def fetch_statement(table_name, quals, columns, sortkeys=None):
+        # type: (str, List[Qual], List[str], List[SortKey]) -> str
+        """Converts the supplied quals, columns, and sortkeys to a fetch
+        statement.
+        """
+        select_clause = ", ".join(columns) if columns else "*"
+        statement = "SELECT {} FROM {}".format(select_clause, table_name)
+        if len(quals) > 0:
+            statement += " WHERE " + " AND ".join(str(qual) for qual in quals)
+        return statement + ";"
 
     @staticmethod
     def execute_fetch_statement(cursor,
@@ -27,11 +138,9 @@ class SamplingStrategy(object):
 
         The results can be obtained by iterating through the cursor.
         """
-        select_clause = ", ".join(columns) if columns else "*"
-        statement = "SELECT {} FROM {}".format(select_clause, table_name)
-        if len(quals) > 0:
-            statement += " WHERE " + " AND ".join(str(qual) for qual in quals)
-        cursor.execute(statement + ";")
+        cursor.execute(
+            SamplingStrategy.fetch_statement(table_name, quals, columns,
+                                             sortkeys))
 
     @staticmethod
     def execute_insert_statement(cursor, table_name, values):
@@ -75,7 +184,7 @@ class SamplingStrategy(object):
         where_clause = " AND ".join("{} = %s".format(value)
                                     for value in oldvalues.keys())
         statement = "DELETE FROM {} WHERE {}".format(table_name, where_clause)
-        cursor.execute(statement, oldvalues.values())
+        cursor.execute(statement, list(oldvalues.values()))
         return cursor.rowcount
 
     @staticmethod
@@ -90,21 +199,66 @@ class SamplingStrategy(object):
         return cursor.fetchone()[0]
 
     @staticmethod
-    def create_table(cursor, table_name, columns, exists_ok=False):
-        # type (psycopg2.cursor, str, List[ColumnDefinition], bool) -> None
+    def create_table(cursor,
+                     table_name,
+                     columns,
+                     exists_ok=False,
+                     partition_by=None):
+        # type (psycopg2.cursor, str, List[ColumnDefinition], bool, Optional[str]) -> None
         """Creates a table with the specified name and column definitions in
         the database associated with the supplied cursor.
 
         If exists_ok is false, this command will fail if the table already
         exists.
+        If partition_by is supplied, such as "LIST (column)", the table is
+        created as a partitioned table, and rows can only be stored in it once
+        partitions are created with create_partition.
         """
         create_table_statement = "CREATE TABLE"
         if exists_ok:
             create_table_statement += " IF NOT EXISTS"
         create_table_statement += " {}({})".format(table_name, ", ".join(
             column.to_statement() for column in columns))
+        if partition_by is not None:
+            create_table_statement += " PARTITION BY " + partition_by
         cursor.execute(create_table_statement)
 
+    @staticmethod
+    def table_is_partitioned(cursor, table_name):
+        # type: (psycopg2.cursor, str) -> bool
+        """Returns true if the table with the supplied name is a partitioned
+        table.
+        """
+        cursor.execute(
+            "SELECT EXISTS(SELECT * FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+            (table_name, ))
+        return cursor.fetchone()[0]
+
+    @staticmethod
+    def create_partition(cursor, table_name, partition_name, bound,
+                         bound_values=()):
+        # type: (psycopg2.cursor, str, str, str, Iterable[Any]) -> None
+        """Creates a partition of a partitioned table if it does not exist.
+
+        The bound is the partition bound after FOR VALUES, such as "IN (%s)"
+        or "FROM (%s) TO (%s)", and bound_values are its parameters.
+        """
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES {}".
+            format(partition_name, table_name, bound), list(bound_values))
+
+    @staticmethod
+    def drop_partition(cursor, table_name, partition_name):
+        # type: (psycopg2.cursor, str, str) -> None
+        """Detaches a partition from a partitioned table and drops it, if it
+        exists.
+        """
+        if not SamplingStrategy.table_exists(cursor, partition_name):
+            return
+        cursor.execute("ALTER TABLE {} DETACH PARTITION {}".format(
+            table_name, partition_name))
+        cursor.execute("DROP TABLE {}".format(partition_name))
+
     @staticmethod
     def get_count(cursor, table_name, quals=None):
         # type: (psycopg2.cursor, str, List[Qual]) -> int
@@ -151,7 +305,7 @@ class SamplingStrategy(object):
         """This function is used to retrieve results from the local database.
 
         If the given query can be resolved by the information in the local
-        database, the result of the query is returned.
+        database, the result of the query is returned as an iterable of rows.
         Otherwise, this function can return None to attempt to fetch the data
         from the remote database.
         """
@@ -160,6 +314,8 @@ class SamplingStrategy(object):
     def fetch_remotely(self, remote_cursor, quals, columns, sortkeys=None):
         # type: (psycopg2.cursor, List[Qual], List[str], List[SortKey]) -> Iterable[Any]
         """This function is used to retrieve results from the remote database.
+
+        The results are returned as an iterable of rows.
         """
         return None
 
@@ -170,6 +326,7 @@ class SamplingStrategy(object):
 
         Whenever query results are retrieved from the remote databse, this
         function is called to insert the results into the local database.
+        The results are rows in the format returned by fetch_remotely.
         This function returns the number of rows added to the local database.
         """
         return 0
@@ -232,6 +389,32 @@ class SamplingStrategy(object):
         raise NotImplementedError("{} does not support the writable API".
                                   format(self.__class__.__name__))
 
+    def metadata(self):  # type: () -> Dict[str, Any]
+        """Returns additional statistics about the sampling strategy, keyed by
+        column name, that are listed by MetadataFdw.
+        """
+        return {}
+
+    @property
+    def routable(self):  # type: () -> bool
+        """True if the local and remote databases give the same answer to
+        every query that the local database can answer, so that SamplingFdw
+        may send queries straight to the remote database.
+        """
+        return True
+
+    def explain(self, quals, columns, sortkeys=None):
+        # type: (List[Qual], List[str], List[SortKey]) -> List[str]
+        """Returns lines for EXPLAIN describing how the sampling strategy would
+        answer a query, such as the SQL it would send to each database.
+
+        This function must not query either database.
+        """
+        return [
+            "Remote SQL: " + self.fetch_statement(
+                self.table_name, quals, self.select_list(columns), sortkeys)
+        ]
+
     def fetch_more_rows(self, remote_cursor, local_cursor, oldvalue, newvalue):
         # type: (psycopg2.cursor, psycopg2.cursor, int, int) -> int
         """Increases the size of the sample from the remote database that is
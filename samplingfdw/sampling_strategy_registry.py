@@ -1,18 +1,69 @@
+import importlib
 import logging
 from multicorn.utils import log_to_postgres
+import os
+import pkgutil
 import sys
-from typing import Type, Dict, Callable
+import time
+from typing import Any, Type, Dict, Callable, Optional
 
 from samplingfdw.sampling_strategy import SamplingStrategy
 
+# Maps the names of the strategies shipped with samplingfdw to the modules that
+# register them, so that only the strategies that are used get imported.
+STRATEGY_MODULES = {
+    "remote_sampling_strategy": "samplingfdw.remote_sampling_strategy",
+    "selection_sampling_strategy": "samplingfdw.selection_sampling_strategy",
+    "weighted_sampling_strategy": "samplingfdw.weighted_sampling_strategy",
+}
+
+# The entry point group under which other packages can provide strategies.
+# The name of an entry point is the name of the strategy, and it refers to
+# the SamplingStrategy subclass, or to a module that registers it.
+ENTRY_POINT_GROUP = "samplingfdw.strategies"
+
+
+def find_entry_point(name):  # type: (str) -> Optional[Any]
+    """Returns the installed entry point for the strategy with the supplied
+    name, or None if there is none.
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return None
+        return next(
+            pkg_resources.iter_entry_points(ENTRY_POINT_GROUP, name), None)
+    all_entry_points = entry_points()
+    if hasattr(all_entry_points, "select"):
+        candidates = all_entry_points.select(group=ENTRY_POINT_GROUP,
+                                             name=name)
+    else:
+        candidates = [
+            entry_point
+            for entry_point in all_entry_points.get(ENTRY_POINT_GROUP, [])
+            if entry_point.name == name
+        ]
+    return next(iter(candidates), None)
+
 
 class _SamplingStrategyRegistry(object):
     """A registry that allows SamplingStrategy classes to be registered and
     looked up.
+
+    Strategies are imported when they are first looked up, from the module
+    listed in STRATEGY_MODULES, from an installed entry point in the
+    ENTRY_POINT_GROUP group, or else from the samplingfdw module with the same
+    name as the strategy. If none of them registers the strategy, every
+    module of the samplingfdw package that is not imported yet is imported.
+    The number of seconds each import took is kept in import_times.
     """
 
     def __init__(self):  # type: () -> None
         self.registry = {}  # type: Dict[str, Type[SamplingStrategy]]
+        self.import_times = {}  # type: Dict[str, float]
 
     def register(self, name):
         # type: (str) -> Callable[[Type[SamplingStrategy]], Type[SamplingStrategy]]
@@ -30,10 +81,44 @@ class _SamplingStrategyRegistry(object):
 
         return wrapper
 
+    def load(self, name):  # type: (str) -> None
+        """Imports the strategy with the supplied name, if it can be found."""
+        start = time.time()
+        if name in STRATEGY_MODULES:
+            importlib.import_module(STRATEGY_MODULES[name])
+        else:
+            entry_point = find_entry_point(name)
+            if entry_point is not None:
+                loaded = entry_point.load()
+                if (isinstance(loaded, type) and
+                        issubclass(loaded, SamplingStrategy) and
+                        name not in self.registry):
+                    self.registry[name] = loaded
+            elif any(
+                    os.path.exists(os.path.join(path, name + ".py"))
+                    for path in sys.modules["samplingfdw"].__path__):
+                importlib.import_module("samplingfdw." + name)
+        if name not in self.registry:
+            self.import_package_modules()
+        self.import_times[name] = time.time() - start
+
+    @staticmethod
+    def import_package_modules():  # type: () -> None
+        """Imports every module of the samplingfdw package that is not
+        imported yet, registering the strategies they define.
+        """
+        for _, module_name, _ in pkgutil.iter_modules(
+                sys.modules["samplingfdw"].__path__):
+            module_name = "samplingfdw." + module_name
+            if module_name not in sys.modules:
+                importlib.import_module(module_name)
+
     def get_strategy(self, name):  # type: (str) -> Type[SamplingStrategy]
         """Returns the strategy registered for the supplied name, if one
-        exists.
+        exists, importing it first if needed.
         """
+        if name not in self.registry:
+            self.load(name)
         if name not in self.registry:
             log_to_postgres("No strategy registered for " + name,
                             logging.ERROR)
@@ -1,10 +1,18 @@
+import collections
+import hashlib
 import logging
-from multicorn import Qual, SortKey
+from multicorn import ColumnDefinition, Qual, SortKey, ANY
 from multicorn.utils import log_to_postgres
 import psycopg2
-from typing import List, Iterable, Any, Dict, Optional
+import threading
+import time
+from typing import List, Iterable, Any, Callable, Dict, Optional, Set, Tuple
 
-from samplingfdw.sampling_strategy import SamplingStrategy
+from samplingfdw.bloom_filter import BloomFilter
+from samplingfdw.columnar_store import ColumnarStore
+from samplingfdw.index_advisor import IndexAdvisor
+from samplingfdw.prefetcher import Prefetcher
+from samplingfdw.sampling_strategy import SamplingStrategy, SAMPLE_WEIGHT_COLUMN
 from samplingfdw.sampling_strategy_registry import SamplingStrategyRegistry
 
 
@@ -12,6 +20,9 @@ from samplingfdw.sampling_strategy_registry import SamplingStrategyRegistry
 class SelectionSamplingStrategy(SamplingStrategy):
     """SamplingStrategy that stores only specified values of a specified column locally.
 
+    Every row with a stored value is stored, so the _sample_weight column, if
+    declared, is 1 for every row.
+
     Accepted options:
         column        -- The column which the supplied column_values are for.
         column_values -- The comma delimited values for the supplied column that
@@ -19,8 +30,93 @@ class SelectionSamplingStrategy(SamplingStrategy):
         primary_key   -- (optional) Identifies a column which is a primary key
                          in the remote RDBMS. This options is required for
                          INSERT, UPDATE and DELETE operations.
+        key_filter    -- (optional) If 'true', a Bloom filter of the primary
+                         keys stored in the local table is kept in memory, so
+                         that lookups of rows that are not stored locally skip
+                         the local database. The filter is only used while the
+                         local table is unchanged since it was built, and is
+                         rebuilt in the background otherwise, so rows stored
+                         through other backends are seen after at most
+                         version_check_interval seconds. Requires primary_key.
+        key_filter_error_rate -- (optional) The false positive rate of the
+                                 key filter. Defaults to 0.01.
+        max_staleness -- (optional) The number of seconds after which the rows
+                         stored locally for a value in column_values are
+                         considered stale. Stale rows are still returned from
+                         the local database, but trigger a refresh of the rows
+                         for that value from the remote database in a
+                         background thread.
+        max_staleness_hard -- (optional) The number of seconds after which the
+                              rows stored locally for a value in column_values
+                              are no longer used, and queries for that value
+                              are run on the remote database until the rows
+                              are refreshed. Requires max_staleness.
+        prefetch      -- (optional) If 'true', the values of column requested
+                         in queries are used to predict which values will be
+                         requested next, and the rows for those values are
+                         fetched into the local table in a background thread.
+                         Prefetched values are then answered locally like
+                         values in column_values. Other backends do not know
+                         which values this backend prefetched, and do not
+                         write their changes to those rows to the local table,
+                         so prefetched rows are refreshed like the rows for
+                         column_values. Before a prefetched value is answered
+                         locally, its fill time is checked in the local
+                         database, so values evicted by another backend are
+                         fetched remotely. Requires max_staleness.
+        prefetch_rows_per_second -- (optional) The maximum average rate at
+                                    which rows are prefetched. Defaults to 1000.
+        prefetch_max_rows -- (optional) Values with more rows than this are not
+                             prefetched. Defaults to 10000.
+        prefetch_max_values -- (optional) The maximum number of values that are
+                               prefetched. Defaults to 100.
+        local_store   -- (optional) Either 'postgres', the default, or
+                         'columnar'. If 'columnar', local queries are answered
+                         from a copy of the local table kept in memory-mapped
+                         NumPy column files, which are shared by every backend
+                         and rebuilt from the local table in a background
+                         thread after it changes. Queries that the column files
+                         cannot answer, or that arrive while they are out of
+                         date, still use the local database. Requires numpy.
+                         Changes made through other backends are seen after
+                         at most version_check_interval seconds.
+        local_store_path -- (optional) The directory holding the column files.
+                            Required if local_store is 'columnar'.
+        version_check_interval -- (optional) The number of seconds for which
+                                  the version of the local table, which tells
+                                  whether other backends changed it, is reused
+                                  before it is read again. Defaults to 1.
+        partition_local_table -- (optional) If 'true', the local table is
+                                 created as a table partitioned by list on
+                                 column, with one partition per cached value.
+                                 Refreshes truncate the partition of a value,
+                                 and evicting a prefetched value drops its
+                                 partition, instead of deleting rows. Range
+                                 partitioning is not supported, as the local
+                                 table is filled and evicted one value at a
+                                 time. Requires PostgreSQL 10 or later.
+        auto_index    -- (optional) If 'true', the columns used in the quals of
+                         queries answered from the local table are recorded,
+                         and btree indexes are created on frequently used
+                         columns and dropped once unused, on a background
+                         thread.
+        auto_index_threshold -- (optional) The number of quals on a column
+                                after which it is indexed. Defaults to 100.
+        auto_index_unused_seconds -- (optional) The number of seconds an
+                                     automatic index must go unscanned before
+                                     it is dropped. Defaults to 86400.
+        cached_columns -- (optional) The comma delimited columns that are
+                          stored in the local table. column and primary_key
+                          are always stored. Queries that only use these
+                          columns are answered locally. If primary_key is set,
+                          queries that request other columns are answered by
+                          fetching the local rows and then only their missing
+                          columns from the remote database, by primary key.
+                          Defaults to every column.
     """
 
+    sequence_rows = True
+
     def on_open(self, remote_cursor, local_cursor):
         # type: (psycopg2.cursor, psycopg2.cursor) -> int
         """If the table table_name.local does not exist in the local database,
@@ -41,33 +137,655 @@ class SelectionSamplingStrategy(SamplingStrategy):
                        self.__class__.__name__), logging.ERROR)
 
         self.local_table_name = "_local_" + self.table_name
+        self.local_columns = [
+            column for column in self.columns if column != SAMPLE_WEIGHT_COLUMN
+        ]
+        if "cached_columns" in self.options:
+            cached_columns = set(self.options["cached_columns"].split(","))
+            cached_columns.add(self.options["column"])
+            if "primary_key" in self.options:
+                cached_columns.add(self.options["primary_key"])
+            self.local_columns = [
+                column for column in self.local_columns
+                if column in cached_columns
+            ]
+        self._stitch_connection = None  # type: psycopg2.connection
+        self._stitch_options = None  # type: Optional[Dict[str, str]]
         self.selection_quals = [
             Qual(self.options["column"], "=", column_value)
             for column_value in self.options["column_values"].split(",")
         ]
-        if self.table_exists(local_cursor, self.local_table_name):
-            return self.get_count(local_cursor, self.local_table_name)
+        self.cached_values = set(self.options["column_values"].split(","))
+        # The key filter, with the version of the local table it was built
+        # from
+        self.key_filter = None  # type: Optional[Tuple[int, BloomFilter]]
+        self.prefetcher = None  # type: Optional[Prefetcher]
+        self.columnar_store = None  # type: Optional[ColumnarStore]
+        self.index_advisor = None  # type: Optional[IndexAdvisor]
+        self.fill_times = None  # type: Optional[Dict[str, float]]
+        self.version_table_name = None  # type: Optional[str]
+        self._version = 0
+        self._version_checked_at = None  # type: Optional[float]
+        self._background_lock = threading.Lock()
+        self._background_tasks = set()  # type: Set[str]
+        self.background_errors = collections.Counter(
+        )  # type: collections.Counter
+        if "max_staleness" in self.options:
+            self.load_fill_times(local_cursor)
+        if (self.options.get("local_store", "postgres") == "columnar" or
+                self.options.get("key_filter", "false") == "true"):
+            self.create_version_table(local_cursor)
+        if not self.table_exists(local_cursor, self.local_table_name):
+            if self.options.get("partition_local_table", "false") == "true":
+                self.create_table(
+                    local_cursor,
+                    self.local_table_name,
+                    self.local_column_definitions,
+                    partition_by="LIST ({})".format(self.options["column"]))
+                self.partitioned = True
+                for qual in self.selection_quals:
+                    self.fill_value(remote_cursor, local_cursor, qual.value)
+            else:
+                filled_at = time.time()
+                self.create_table(local_cursor, self.local_table_name,
+                                  self.local_column_definitions)
+                self.execute_fetch_statement(remote_cursor, self.table_name,
+                                             self.selection_quals,
+                                             self.local_columns)
+                self.insert_values(local_cursor, self.local_table_name,
+                                   remote_cursor)
+                if self.fill_times is not None:
+                    for qual in self.selection_quals:
+                        self.record_fill_time(local_cursor, qual.value,
+                                              filled_at)
+        # A local table created before partition_local_table was set is used
+        # as it is
+        self.partitioned = (
+            self.options.get("partition_local_table", "false") == "true" and
+            self.table_is_partitioned(local_cursor, self.local_table_name))
 
-        self.create_table(local_cursor, self.local_table_name,
-                          self.columns.values())
-        self.execute_fetch_statement(remote_cursor, self.table_name,
-                                     self.selection_quals, None)
-        self.insert_values(local_cursor, self.local_table_name, remote_cursor)
+        if self.options.get("key_filter", "false") == "true":
+            if "primary_key" not in self.options:
+                log_to_postgres(
+                    "You need to declare a primary_key option in order to use the key filter",
+                    logging.ERROR)
+            self.build_key_filter(local_cursor)
+
+        if self.options.get("prefetch", "false") == "true":
+            if "max_staleness" not in self.options:
+                log_to_postgres(
+                    "You need to declare a max_staleness option in order to use prefetching",
+                    logging.ERROR)
+            self.prefetcher = Prefetcher(
+                self.prefetch_value,
+                self.evict_value,
+                self.connection_options(self.options, "local_"),
+                self.read_connection_options,
+                float(self.options.get("prefetch_rows_per_second", 1000)),
+                int(self.options.get("prefetch_max_values", 100)))
+
+        if self.options.get("local_store", "postgres") == "columnar":
+            if "local_store_path" not in self.options:
+                log_to_postgres(
+                    "You need to declare a local_store_path option in order to use the columnar local store",
+                    logging.ERROR)
+            self.columnar_store = ColumnarStore(
+                self.options["local_store_path"], self.columns,
+                self.local_columns)
+
+        if self.options.get("auto_index", "false") == "true":
+            self.index_advisor = IndexAdvisor(
+                self.local_table_name,
+                self.connection_options(self.options, "local_"),
+                int(self.options.get("auto_index_threshold", 100)),
+                float(self.options.get("auto_index_unused_seconds", 86400)),
+                partitioned=self.partitioned)
+            self.index_advisor.load_indexes(local_cursor)
         return self.get_count(local_cursor, self.local_table_name)
 
+    @property
+    def local_column_definitions(self):
+        # type: () -> List[ColumnDefinition]
+        """The definitions of the columns stored in the local table."""
+        return [self.columns[column] for column in self.local_columns]
+
+    def local_values(self, values):
+        # type: (Dict[str, Any]) -> Dict[str, Any]
+        """Returns the supplied column values that are stored in the local
+        table.
+        """
+        return {
+            column: value
+            for column, value in values.items() if column in self.local_columns
+        }
+
+    @property
+    def stitch_connection(self):  # type: () -> psycopg2.connection
+        """Returns a connection to the remote database that is used to fetch
+        the columns that are not stored locally.
+
+        The connection is reopened if it was closed, or if the replica it goes
+        to can no longer be read from.
+        """
+        options = self.read_connection_options(self._stitch_options)
+        if (self._stitch_connection is None or
+                self._stitch_connection.closed or
+                options != self._stitch_options):
+            if self._stitch_connection is not None:
+                self._stitch_connection.close()
+            self._stitch_connection = psycopg2.connect(**options)
+            self._stitch_options = options
+        return self._stitch_connection
+
+    def fetch_stitched(self, local_cursor, quals, columns, sortkeys=None):
+        # type: (psycopg2.cursor, List[Qual], List[str], List[SortKey]) -> List[Any]
+        """Fetches the requested columns that are stored locally from the local
+        table, and the other requested columns of the same rows from the
+        remote database by primary key.
+
+        Rows that no longer exist in the remote database are left out.
+        """
+        primary_key = self.options["primary_key"]
+        local_select = [
+            column for column in self.local_columns
+            if column in columns or column == primary_key
+        ]
+        remote_select = [
+            column for column in self.columns
+            if column in columns and column not in self.local_columns and
+            column != SAMPLE_WEIGHT_COLUMN
+        ]
+        self.execute_fetch_statement(local_cursor, self.local_table_name,
+                                     quals, local_select, sortkeys)
+        local_rows = list(local_cursor)
+        key_index = local_select.index(primary_key)
+        keys = [local_row[key_index] for local_row in local_rows]
+        if not keys:
+            return []
+        with self.stitch_connection:
+            remote_cursor = self.stitch_connection.cursor()
+            remote_cursor.execute("SELECT {}, {} FROM {} WHERE {} = ANY(%s)".
+                                  format(primary_key, ", ".join(remote_select),
+                                         self.table_name, primary_key),
+                                  (keys, ))
+            remote_rows = {
+                remote_row[0]: remote_row[1:]
+                for remote_row in remote_cursor
+            }
+
+        local_indexes = {column: i for i, column in enumerate(local_select)}
+        remote_indexes = {column: i for i, column in enumerate(remote_select)}
+        rows = []
+        for key, local_row in zip(keys, local_rows):
+            remote_row = remote_rows.get(key)
+            if remote_row is None:
+                continue
+            row = {}  # type: Dict[str, Any]
+            for column in columns:
+                if column in local_indexes:
+                    row[column] = local_row[local_indexes[column]]
+                elif column == SAMPLE_WEIGHT_COLUMN:
+                    row[column] = 1.0
+                else:
+                    row[column] = remote_row[remote_indexes[column]]
+            if self.sequence_rows:
+                rows.append(tuple(row.get(column) for column in self.columns))
+            else:
+                rows.append(row)
+        return rows
+
+    def create_version_table(self, local_cursor):
+        # type: (psycopg2.cursor) -> None
+        """Creates the table holding the version of the local table, if it
+        does not exist.
+
+        Every transaction that changes the local table increments the version,
+        so state derived from the local table outside of the local database is
+        out of date once a later version is committed.
+        """
+        self.version_table_name = self.local_table_name + "_version"
+        local_cursor.execute(
+            "CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY, version BIGINT NOT NULL)".
+            format(self.version_table_name))
+        local_cursor.execute(
+            "INSERT INTO {} (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING".
+            format(self.version_table_name))
+
+    def query_local_table_version(self, local_cursor):
+        # type: (psycopg2.cursor) -> int
+        """Returns the committed version of the local table."""
+        local_cursor.execute("SELECT version FROM {} WHERE id = 1".format(
+            self.version_table_name))
+        return local_cursor.fetchone()[0]
+
+    def local_table_version(self, local_cursor):
+        # type: (psycopg2.cursor) -> int
+        """Returns the committed version of the local table, as of at most
+        version_check_interval seconds ago.
+
+        Changes made through this backend are seen by the next call.
+        """
+        now = time.time()
+        if self._version_checked_at is None or (
+                now - self._version_checked_at >= float(
+                    self.options.get("version_check_interval", 1))):
+            self._version = self.query_local_table_version(local_cursor)
+            self._version_checked_at = now
+        return self._version
+
+    def run_in_background(self, task, function):
+        # type: (str, Callable[[psycopg2.cursor], None]) -> None
+        """Calls function with a cursor to the local database in a background
+        thread, unless task is already running in this backend.
+
+        The thread cannot report errors to Postgres, so failures are counted
+        in background_errors under the name of the task.
+        """
+        with self._background_lock:
+            if task in self._background_tasks:
+                return
+            self._background_tasks.add(task)
+
+        def run():  # type: () -> None
+            try:
+                local_connection = psycopg2.connect(
+                    **self.connection_options(self.options, "local_"))
+                try:
+                    with local_connection:
+                        function(local_connection.cursor())
+                finally:
+                    local_connection.close()
+            except (psycopg2.Error, EnvironmentError):
+                self.background_errors[task] += 1
+            finally:
+                with self._background_lock:
+                    self._background_tasks.discard(task)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def build_columnar_store(self, local_cursor):
+        # type: (psycopg2.cursor) -> None
+        """Writes a new copy of the local table to the columnar store.
+
+        The version is read before the rows, so a change committed in between
+        leaves the copy out of date rather than labelled as current.
+        """
+        version = self.query_local_table_version(local_cursor)
+        self.execute_fetch_statement(local_cursor, self.local_table_name, [],
+                                     self.local_columns)
+        self.columnar_store.write(local_cursor, version)
+
+    def fetch_from_columnar_store(self, local_cursor, quals, columns):
+        # type: (psycopg2.cursor, List[Qual], List[str]) -> Optional[Iterable[Any]]
+        """Returns the rows of the local table satisfying the supplied quals
+        from the columnar store.
+
+        Returns None if the columnar store cannot answer the query, or if it
+        is out of date, in which case it is rebuilt in the background.
+        """
+        if not self.columnar_store.is_valid(
+                self.local_table_version(local_cursor)):
+            self.run_in_background("columnar_store",
+                                   self.build_columnar_store)
+            return None
+        return self.columnar_store.fetch(quals, columns)
+
+    def local_table_changed(self, local_cursor):
+        # type: (psycopg2.cursor) -> None
+        """Increments the version of the local table in the transaction that
+        changes it, if the version is kept.
+        """
+        if self.version_table_name is not None:
+            local_cursor.execute(
+                "UPDATE {} SET version = version + 1 WHERE id = 1".format(
+                    self.version_table_name))
+            self._version_checked_at = None
+
+    def load_fill_times(self, local_cursor):
+        # type: (psycopg2.cursor) -> None
+        """Creates the table recording when the rows for each value in
+        column_values were fetched from the remote database, if it does not
+        exist, and loads it into memory.
+
+        Values without a recorded fill time are treated as filled at the
+        epoch, so they are refreshed on first use.
+        """
+        self.fill_times_table_name = self.local_table_name + "_fill_times"
+        self._refresh_lock = threading.Lock()
+        self._refreshing = set()  # type: Set[str]
+        local_cursor.execute(
+            "CREATE TABLE IF NOT EXISTS {} (column_value TEXT PRIMARY KEY, filled_at DOUBLE PRECISION)".
+            format(self.fill_times_table_name))
+        local_cursor.execute("SELECT column_value, filled_at FROM {}".format(
+            self.fill_times_table_name))
+        self.fill_times = dict(local_cursor)
+
+    def record_fill_time(self, local_cursor, column_value, filled_at):
+        # type: (psycopg2.cursor, str, float) -> None
+        """Records that the rows for the supplied value in column_values were
+        fetched from the remote database at the supplied time.
+        """
+        local_cursor.execute(
+            "INSERT INTO {} (column_value, filled_at) VALUES (%s, %s) ON CONFLICT (column_value) DO UPDATE SET filled_at = EXCLUDED.filled_at".
+            format(self.fill_times_table_name), (column_value, filled_at))
+        self.fill_times[column_value] = filled_at
+
+    def is_fresh_enough(self, column_value):  # type: (str) -> bool
+        """Returns False if the rows stored locally for the supplied value in
+        column_values are older than max_staleness_hard.
+
+        If they are older than max_staleness, a background refresh of the
+        rows is started.
+        """
+        if self.fill_times is None:
+            return True
+        age = time.time() - self.fill_times.get(column_value, 0)
+        if age > float(self.options["max_staleness"]):
+            self.schedule_refresh(column_value)
+        return age <= float(self.options.get("max_staleness_hard", "inf"))
+
+    def schedule_refresh(self, column_value):  # type: (str) -> None
+        """Refreshes the rows stored locally for the supplied value in
+        column_values in a background thread, unless a refresh is already
+        running for it.
+        """
+        with self._refresh_lock:
+            if column_value in self._refreshing:
+                return
+            self._refreshing.add(column_value)
+        thread = threading.Thread(
+            target=self._refresh_in_background, args=(column_value, ))
+        thread.daemon = True
+        thread.start()
+
+    def _refresh_in_background(self, column_value):  # type: (str) -> None
+        """Refreshes the rows for the supplied value using connections owned
+        by the calling thread.
+        """
+        try:
+            local_connection = psycopg2.connect(
+                **self.connection_options(self.options, "local_"))
+            remote_connection = psycopg2.connect(
+                **self.read_connection_options())
+            try:
+                with remote_connection, local_connection:
+                    self.refresh_value(remote_connection.cursor(),
+                                       local_connection.cursor(), column_value)
+            finally:
+                remote_connection.close()
+                local_connection.close()
+        except psycopg2.Error:
+            self.background_errors["refresh"] += 1
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard(column_value)
+
+    def refresh_value(self, remote_cursor, local_cursor, column_value):
+        # type: (psycopg2.cursor, psycopg2.cursor, str) -> None
+        """Replaces the rows stored locally for the supplied value in
+        column_values with the current rows in the remote database.
+
+        The refresh is skipped if another backend refreshed the rows after
+        they became stale.
+        """
+        self.lock_value(local_cursor, column_value)
+        if self.stored_fill_time_is_fresh(local_cursor, column_value):
+            return
+        self.fill_value(remote_cursor, local_cursor, column_value)
+
+    def stored_fill_time_is_fresh(self, local_cursor, column_value):
+        # type: (psycopg2.cursor, Any) -> bool
+        """Returns True if the rows for the supplied value of column were
+        filled less than max_staleness seconds ago, according to the fill time
+        recorded in the local database.
+        """
+        local_cursor.execute(
+            "SELECT filled_at FROM {} WHERE column_value = %s::text".format(
+                self.fill_times_table_name), (column_value, ))
+        result = local_cursor.fetchone()
+        if result is None or (time.time() - result[0] > float(
+                self.options["max_staleness"])):
+            return False
+        self.fill_times[column_value] = result[0]
+        return True
+
+    def lock_value(self, local_cursor, column_value):
+        # type: (psycopg2.cursor, Any) -> None
+        """Waits until no other transaction fills or evicts the rows for the
+        supplied value of column, and keeps them from doing so until the
+        current transaction ends.
+        """
+        local_cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))",
+                             (self.value_lock_key(column_value), ))
+
+    def value_lock_key(self, column_value):  # type: (Any) -> str
+        """Returns the key of the advisory lock held while the rows for the
+        supplied value of column are filled or evicted.
+        """
+        return "{}:{}".format(self.local_table_name, column_value)
+
+    def fill_value(self, remote_cursor, local_cursor, column_value):
+        # type: (psycopg2.cursor, psycopg2.cursor, Any) -> int
+        """Replaces the rows stored locally for the supplied value of column
+        with the current rows in the remote database.
+
+        This function returns the number of rows stored locally.
+        """
+        self.lock_value(local_cursor, column_value)
+        filled_at = time.time()
+        column = self.options["column"]
+        self.execute_fetch_statement(remote_cursor, self.table_name,
+                                     [Qual(column, "=", column_value)],
+                                     self.local_columns)
+        rows = list(remote_cursor)
+        if self.partitioned:
+            partition_name = self.create_value_partition(
+                local_cursor, column_value)
+            local_cursor.execute("TRUNCATE {}".format(partition_name))
+            self.insert_values(local_cursor, partition_name, rows)
+        else:
+            self.execute_delete_statement(local_cursor, self.local_table_name,
+                                          {column: column_value})
+            self.insert_values(local_cursor, self.local_table_name, rows)
+        self.local_table_changed(local_cursor)
+        if self.fill_times is not None:
+            self.record_fill_time(local_cursor, column_value, filled_at)
+        return len(rows)
+
+    def partition_name(self, column_value):  # type: (Any) -> str
+        """Returns the name of the partition of the local table that holds the
+        rows for the supplied value of column.
+        """
+        return "{}_{}".format(
+            self.local_table_name,
+            hashlib.md5(str(column_value).encode("utf-8")).hexdigest()[:16])
+
+    def create_value_partition(self, local_cursor, column_value):
+        # type: (psycopg2.cursor, Any) -> str
+        """Creates the partition of the local table for the supplied value of
+        column if it does not exist, and returns its name.
+        """
+        partition_name = self.partition_name(column_value)
+        self.create_partition(local_cursor, self.local_table_name,
+                              partition_name, "IN (%s)", [column_value])
+        return partition_name
+
+    def evict_value(self, remote_cursor, local_cursor, column_value):
+        # type: (psycopg2.cursor, psycopg2.cursor, Any) -> None
+        """Removes the rows stored locally for the supplied value of column.
+
+        If the local table is partitioned, the partition for the value is
+        dropped.
+        """
+        self.lock_value(local_cursor, column_value)
+        if self.partitioned:
+            self.drop_partition(local_cursor, self.local_table_name,
+                                self.partition_name(column_value))
+        else:
+            self.execute_delete_statement(local_cursor, self.local_table_name,
+                                          {self.options["column"]: column_value})
+        self.local_table_changed(local_cursor)
+        if self.fill_times is not None:
+            local_cursor.execute(
+                "DELETE FROM {} WHERE column_value = %s::text".format(
+                    self.fill_times_table_name), (column_value, ))
+            self.fill_times.pop(column_value, None)
+
+    def prefetch_value(self, remote_cursor, local_cursor, column_value):
+        # type: (psycopg2.cursor, psycopg2.cursor, Any) -> Optional[int]
+        """Fills the rows for a value of column predicted by the prefetcher
+        into the local table, and starts answering queries for it locally.
+
+        Values with more than prefetch_max_rows rows are skipped, in which case
+        this function returns None. Otherwise, it returns the number of rows
+        fetched from the remote database, which is 0 if another backend filled
+        the value recently.
+        """
+        self.lock_value(local_cursor, column_value)
+        if self.stored_fill_time_is_fresh(local_cursor, column_value):
+            return 0
+        qual = Qual(self.options["column"], "=", column_value)
+        if self.get_count(remote_cursor, self.table_name, [qual]) > int(
+                self.options.get("prefetch_max_rows", 10000)):
+            return None
+        return self.fill_value(remote_cursor, local_cursor, column_value)
+
+    def prefetched_value_is_stored(self, local_cursor, column_value):
+        # type: (psycopg2.cursor, Any) -> bool
+        """Returns True if the rows for the supplied prefetched value of column
+        are still stored locally, in which case no other backend can fill or
+        evict them until the current transaction ends.
+
+        Values evicted by another backend are forgotten by the prefetcher.
+        Values being filled or evicted by another backend are not answered
+        locally.
+        """
+        local_cursor.execute(
+            "SELECT pg_try_advisory_xact_lock_shared(hashtext(%s)), (SELECT filled_at FROM {} WHERE column_value = %s::text)".
+            format(self.fill_times_table_name),
+            (self.value_lock_key(column_value), column_value))
+        locked, filled_at = local_cursor.fetchone()
+        if not locked:
+            return False
+        if filled_at is None:
+            self.prefetcher.discard(column_value)
+            return False
+        self.fill_times[column_value] = filled_at
+        return True
+
+    def is_cached_value(self, column_value):  # type: (Any) -> bool
+        """Returns True if all rows with the supplied value for column are
+        stored in the local table, either because it is in column_values or
+        because it was prefetched.
+        """
+        return column_value in self.cached_values or (
+            self.prefetcher is not None and
+            column_value in self.prefetcher.prefetched)
+
+    def build_key_filter(self, local_cursor):
+        # type: (psycopg2.cursor) -> None
+        """Rebuilds the key filter from the primary keys in the local table.
+
+        The version is read before the keys, so a change committed in between
+        leaves the filter out of date rather than labelled as current.
+        """
+        version = self.query_local_table_version(local_cursor)
+        local_cursor.execute("SELECT {} FROM {}".format(
+            self.options["primary_key"], self.local_table_name))
+        keys = [result[0] for result in local_cursor]
+        key_filter = BloomFilter(
+            max(2 * len(keys), 1024),
+            float(self.options.get("key_filter_error_rate", 0.01)))
+        key_filter.update(keys)
+        self.key_filter = (version, key_filter)
+
+    def keys_excluded_locally(self, local_cursor, quals):
+        # type: (psycopg2.cursor, List[Qual]) -> bool
+        """Returns True if the key filter shows that none of the primary keys
+        selected by the supplied quals are stored in the local table.
+
+        The key filter is not used if the local table changed since it was
+        built, in which case it is rebuilt in the background.
+        """
+        if self.key_filter is None:
+            return False
+        version, key_filter = self.key_filter
+        if version != self.local_table_version(local_cursor):
+            self.run_in_background("key_filter", self.build_key_filter)
+            return False
+        for qual in quals:
+            if qual.field_name != self.options["primary_key"]:
+                continue
+            if qual.operator == "=" and qual.value is not None:
+                if qual.value not in key_filter:
+                    return True
+            elif (qual.is_list_operator and qual.operator[0] == "=" and
+                  qual.list_any_or_all == ANY):
+                if not any(key in key_filter for key in qual.value):
+                    return True
+        return False
+
     def fetch_locally(self, local_cursor, quals, columns, sortkeys=None):
         # type: (psycopg2.cursor, List[Qual], List[str], List[SortKey]) -> Optional[Iterable[Any]]
         """If one of the quals in the fetch query selects only rows with a
         value from column_values in column, the query can be run on the local
         databse, otherwise we need to run the query on the remote database.
+        If the key filter shows that none of the selected primary keys are
+        stored locally, the local database is not queried at all.
+        If max_staleness is set, stale local rows trigger a background refresh,
+        and rows older than max_staleness_hard are fetched remotely instead.
+        If prefetch is set, the requested values of column are passed to the
+        prefetcher.
+        If local_store is 'columnar', the query is answered from the column
+        files if possible.
+        If auto_index is set, the quals of queries run on the local database
+        are passed to the index advisor.
+        If cached_columns is set, queries with quals on columns that are not
+        stored locally are run on the remote database, and requested columns
+        that are not stored locally are fetched remotely by primary key.
         """
-        for qual in self.selection_quals:
-            if qual in quals:
-                self.execute_fetch_statement(local_cursor,
-                                             self.local_table_name, quals,
-                                             columns, sortkeys)
-                for result in local_cursor:
-                    yield dict(zip(columns, result))
+        if self.prefetcher is not None:
+            for qual in quals:
+                if (qual.field_name == self.options["column"] and
+                        qual.operator == "="):
+                    self.prefetcher.observe(qual.value, self.is_cached_value)
+                    break
+        for qual in quals:
+            if (qual.field_name == self.options["column"] and
+                    qual.operator == "=" and self.is_cached_value(qual.value)):
+                if (qual.value not in self.cached_values and
+                        not self.prefetched_value_is_stored(
+                            local_cursor, qual.value)):
+                    return None
+                if not self.is_fresh_enough(qual.value):
+                    return None
+                if self.prefetcher is not None:
+                    self.prefetcher.record_hit(qual.value)
+                if self.keys_excluded_locally(local_cursor, quals):
+                    return []
+                if self.columnar_store is not None:
+                    rows = self.fetch_from_columnar_store(
+                        local_cursor, quals, columns)
+                    if rows is not None:
+                        return rows
+                if any(qual.field_name not in self.local_columns
+                       for qual in quals):
+                    return None
+                if self.index_advisor is not None:
+                    self.index_advisor.observe(quals)
+                if not set(columns).issubset(self.local_columns +
+                                             [SAMPLE_WEIGHT_COLUMN]):
+                    if "primary_key" not in self.options:
+                        return None
+                    return self.fetch_stitched(local_cursor, quals, columns,
+                                               sortkeys)
+                self.execute_fetch_statement(
+                    local_cursor, self.local_table_name, quals,
+                    self.select_list(columns), sortkeys)
+                return self.rows(local_cursor, columns)
+        return None
 
     def fetch_remotely(self, remote_cursor, quals, columns, sortkeys=None):
         # type: (psycopg2.cursor, List[Qual], List[str], List[SortKey]) -> Iterable[Any]
@@ -75,9 +793,8 @@ class SelectionSamplingStrategy(SamplingStrategy):
         the result.
         """
         self.execute_fetch_statement(remote_cursor, self.table_name, quals,
-                                     columns, sortkeys)
-        for result in remote_cursor:
-            yield dict(zip(columns, result))
+                                     self.select_list(columns), sortkeys)
+        return self.rows(remote_cursor, columns)
 
     @property
     def rowid_column(self):  # type: () -> str
@@ -94,10 +811,16 @@ class SelectionSamplingStrategy(SamplingStrategy):
         """If the value for column is one of the values in column_values, we
         need to insert into the local table.
         """
-        column_values = self.options["column_values"].split(",")
-        if values.get(self.options["column"], None) in column_values:
-            return self.execute_insert_statement(local_cursor,
-                                                 self.local_table_name, values)
+        column_value = values.get(self.options["column"], None)
+        if self.is_cached_value(column_value):
+            if self.partitioned:
+                # The value may have been added to column_values after the
+                # local table was created
+                self.create_value_partition(local_cursor, column_value)
+            rows_added = self.execute_insert_statement(
+                local_cursor, self.local_table_name, self.local_values(values))
+            self.local_table_changed(local_cursor)
+            return rows_added
         return 0
 
     def insert_remotely(self, remote_cursor, values):
@@ -110,24 +833,32 @@ class SelectionSamplingStrategy(SamplingStrategy):
     def update_locally(self, local_cursor, oldvalues, newvalues):
         # type: (psycopg2.cursor, Dict[str, Any], Dict[str, Any]) -> int
         """If we are updating a row that has a value in column_values for
-        column, we need to update it locally.
+        column, we need to update it locally. If its new value is not in
+        column_values, it is deleted locally instead.
         """
         rows_added = 0
         column = self.options["column"]
-        column_values = self.options["column_values"].split(",")
-        if (oldvalues.get(column, None) in column_values) or (
-                newvalues.get(column, None) in column_values):
+        old_cached = self.is_cached_value(oldvalues.get(column, None))
+        new_cached = self.is_cached_value(newvalues.get(column, None))
+        if old_cached and not new_cached:
+            # The row is no longer stored locally, and a partitioned local
+            # table has no partition for its new value
+            self.local_table_changed(local_cursor)
+            return -self.execute_delete_statement(
+                local_cursor, self.local_table_name,
+                self.local_values(oldvalues))
+        if new_cached and self.partitioned and (
+                oldvalues.get(column, None) != newvalues.get(column, None)):
+            self.create_value_partition(local_cursor, newvalues[column])
+        if old_cached or new_cached:
             rows_added = self.execute_update_statement(
-                local_cursor, self.local_table_name, oldvalues, newvalues)
+                local_cursor, self.local_table_name,
+                self.local_values(oldvalues), self.local_values(newvalues))
+            self.local_table_changed(local_cursor)
 
-        if (oldvalues.get(column, None) in column_values) and (
-                newvalues.get(column, None) in column_values):
+        if old_cached:
             return 0
-        if oldvalues.get(column, None) in column_values:
-            return -rows_added
-        if newvalues.get(column, None) in column_values:
-            return rows_added
-        return 0
+        return rows_added
 
     def update_remotely(self, remote_cursor, oldvalues, newvalues):
         # type: (psycopg2.cursor, Dict[str, Any], Dict[str, Any]) -> Dict[str, Any]
@@ -141,12 +872,76 @@ class SelectionSamplingStrategy(SamplingStrategy):
         """If we are deleting a row tthat has a value in column_values for
         column, we need to delete it locally.
         """
-        column_values = self.options["column_values"].split(",")
-        if oldvalues.get(self.options["column"], None) in column_values:
+        if self.is_cached_value(oldvalues.get(self.options["column"], None)):
+            self.local_table_changed(local_cursor)
             return self.execute_delete_statement(
-                local_cursor, self.local_table_name, oldvalues)
+                local_cursor, self.local_table_name,
+                self.local_values(oldvalues))
         return 0
 
+    def explain(self, quals, columns, sortkeys=None):
+        # type: (List[Qual], List[str], List[SortKey]) -> List[str]
+        """Returns whether the rows for the value of column selected by the
+        query are stored locally, and the SQL that would be sent to each
+        database.
+
+        The key filter and staleness bounds can still send a query whose rows
+        are stored locally to the remote database.
+        """
+        lines = super(SelectionSamplingStrategy, self).explain(
+            quals, columns, sortkeys)
+        cached_values = [
+            qual.value for qual in quals
+            if qual.field_name == self.options["column"] and
+            qual.operator == "=" and self.is_cached_value(qual.value)
+        ]
+        if not cached_values:
+            return ["Cache coverage: no value of {} stored locally is selected".
+                    format(self.options["column"])] + lines
+        lines.insert(0, "Cache coverage: {} = {} is stored locally".format(
+            self.options["column"], cached_values[0]))
+        if any(qual.field_name not in self.local_columns for qual in quals):
+            return lines
+        if set(columns).issubset(self.local_columns + [SAMPLE_WEIGHT_COLUMN]):
+            local_select = self.select_list(columns)
+        elif "primary_key" in self.options:
+            local_select = [
+                column for column in self.local_columns
+                if column in columns or column == self.options["primary_key"]
+            ]
+            lines.append("Stitched columns: {} fetched remotely by {}".format(
+                ", ".join(column for column in columns
+                          if column not in self.local_columns and
+                          column != SAMPLE_WEIGHT_COLUMN),
+                self.options["primary_key"]))
+        else:
+            return lines
+        lines.append("Local SQL: " + self.fetch_statement(
+            self.local_table_name, quals, local_select, sortkeys))
+        return lines
+
+    def metadata(self):  # type: () -> Dict[str, Any]
+        """Returns statistics about the key filter, the prefetcher and the
+        automatic indexes, and the number of failures of each of their
+        background threads.
+        """
+        metadata = {}  # type: Dict[str, Any]
+        if self.key_filter is not None:
+            metadata["key_filter_keys"] = self.key_filter[1].count
+        if self.prefetcher is not None:
+            metadata["prefetched_values"] = len(self.prefetcher.prefetched)
+            metadata["prefetched_rows"] = self.prefetcher.prefetched_rows
+            metadata["prefetch_hits"] = self.prefetcher.hits
+            metadata["prefetch_hit_rate"] = self.prefetcher.hit_rate
+            metadata["prefetch_errors"] = self.prefetcher.errors
+        if self.index_advisor is not None:
+            metadata["local_indexes"] = ",".join(
+                sorted(self.index_advisor.indexes))
+            metadata["local_index_errors"] = self.index_advisor.errors
+        for task, errors in self.background_errors.items():
+            metadata[task + "_errors"] = errors
+        return metadata
+
     def delete_remotely(self, remote_cursor, oldvalues):
         # type: (psycopg2.cursor, Dict[str, Any]) -> None
         """Executes the supplied delete statement against the remote databse.
@@ -0,0 +1,95 @@
+import json
+from multicorn import Qual, SortKey
+import psycopg2
+import time
+from typing import Dict, List, Optional
+
+
+def serialize_quals(quals):  # type: (List[Qual]) -> str
+    """Returns the supplied quals as JSON, sorted so that the same quals in
+    another order give the same JSON, as in negative_cache.normalize_quals.
+
+    List operators are written as [operator, use_or] pairs. Values that JSON
+    cannot represent, such as dates, are written as strings.
+    """
+    serialized = [{
+        "field_name": qual.field_name,
+        "operator": (list(qual.operator)
+                     if qual.is_list_operator else qual.operator),
+        "value": (list(qual.value) if qual.is_list_operator else qual.value)
+    } for qual in quals]
+    serialized.sort(
+        key=lambda qual: json.dumps(qual, default=str, sort_keys=True))
+    return json.dumps(serialized, default=str, sort_keys=True)
+
+
+def serialize_sortkeys(sortkeys):  # type: (Optional[List[SortKey]]) -> str
+    """Returns the supplied sort keys as JSON."""
+    return json.dumps(
+        [{
+            "attname": sortkey.attname,
+            "is_reversed": sortkey.is_reversed,
+            "nulls_first": sortkey.nulls_first
+        } for sortkey in sortkeys or []],
+        sort_keys=True)
+
+
+class Trace(object):
+    """What happened while answering one query."""
+
+    def __init__(self, quals, columns, sortkeys):
+        # type: (List[Qual], List[str], Optional[List[SortKey]]) -> None
+        self.quals = quals
+        self.columns = columns
+        self.sortkeys = sortkeys
+        self.traced_at = time.time()
+        # Where the rows came from, such as "local" or "row_cache"
+        self.routing = None  # type: Optional[str]
+        # Maps phases, such as "local" or "store", to the seconds they took
+        self.phases = {}  # type: Dict[str, float]
+        # The seconds from the start of the scan to its end, including the
+        # time Postgres spent between rows
+        self.seconds = None  # type: Optional[float]
+
+    def finish(self):  # type: () -> None
+        """Records that the scan ended."""
+        self.seconds = time.time() - self.traced_at
+
+
+class Tracer(object):
+    """Records every query answered by a SamplingFdw to a table in the local
+    database, so that workloads can be inspected and replayed.
+
+    Each row of the table holds the name of the SamplingFdw, when the query
+    started, its quals, requested columns and sort keys as JSON, where its
+    rows came from, the seconds taken by each phase as JSON, the seconds from
+    the start of the scan to its end, and the number of rows returned.
+    """
+
+    def __init__(self, name, table_name):  # type: (str, str) -> None
+        self.name = name
+        self.table_name = table_name
+
+    def create_table(self, cursor):  # type: (psycopg2.cursor) -> None
+        """Creates the trace table if it does not exist, and adds the columns
+        that trace tables created by earlier versions lack.
+        """
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS {} (name TEXT, traced_at DOUBLE PRECISION, quals TEXT, columns TEXT, sortkeys TEXT, routing TEXT, phases TEXT, seconds DOUBLE PRECISION, rows BIGINT)".
+            format(self.table_name))
+        cursor.execute(
+            "ALTER TABLE {} ADD COLUMN IF NOT EXISTS seconds DOUBLE PRECISION".
+            format(self.table_name))
+
+    def record(self, cursor, trace, rows):
+        # type: (psycopg2.cursor, Trace, int) -> None
+        """Writes a finished trace that returned the supplied number of rows
+        to the trace table.
+        """
+        cursor.execute(
+            "INSERT INTO {} (name, traced_at, quals, columns, sortkeys, routing, phases, seconds, rows) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)".
+            format(self.table_name),
+            (self.name, trace.traced_at, serialize_quals(trace.quals),
+             json.dumps(list(trace.columns)),
+             serialize_sortkeys(trace.sortkeys), trace.routing,
+             json.dumps(trace.phases, sort_keys=True), trace.seconds, rows))
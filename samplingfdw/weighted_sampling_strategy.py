@@ -0,0 +1,313 @@
+import logging
+from multicorn import ColumnDefinition, Qual, SortKey
+from multicorn.utils import log_to_postgres
+import psycopg2
+import random
+from typing import List, Iterable, Any, Dict, Optional
+
+from samplingfdw.sampling_strategy import SamplingStrategy, SAMPLE_WEIGHT_COLUMN
+from samplingfdw.sampling_strategy_registry import SamplingStrategyRegistry
+
+
+@SamplingStrategyRegistry.register("weighted_sampling_strategy")
+class WeightedSamplingStrategy(SamplingStrategy):
+    """SamplingStrategy that stores a random sample of the remote table
+    locally, with the inverse of the probability with which each row was
+    sampled in the _sample_weight column.
+
+    Rows are sampled independently of each other, so aggregates over the
+    sample weighted by _sample_weight, such as SUM(x * _sample_weight) or
+    SUM(_sample_weight), estimate the same aggregates over the remote table.
+    If strata_column is set, the rows with each value of strata_column form a
+    stratum, and strata that are too small to keep min_stratum_rows rows at
+    sample_fraction are sampled with a higher probability, up to 1. The
+    probability of each stratum is recorded in a table next to the local
+    table.
+
+    Queries are answered from the remote database, with a _sample_weight of 1,
+    unless answer_from_sample is set. Updating the answer_from_sample column of
+    MetadataFdw changes it for the current session.
+    Rows inserted through the FDW are added to the sample with the probability
+    of their stratum, and rows updated or deleted through the FDW are updated
+    or deleted in the sample, keeping the weight they were sampled with.
+
+    Accepted options:
+        sample_fraction -- (optional) The probability with which each row is
+                           sampled. Defaults to 0.01.
+        strata_column   -- (optional) The column whose values divide the rows
+                           into strata. Rows with a NULL value are sampled with
+                           sample_fraction.
+        min_stratum_rows -- (optional) The number of rows that each stratum
+                            keeps in the sample, or all of its rows if it has
+                            fewer. Defaults to 0. Requires strata_column.
+        answer_from_sample -- (optional) If 'true', queries are answered from
+                              the sample alone.
+        primary_key     -- (optional) Identifies a column which is a primary
+                           key in the remote RDBMS. This options is required
+                           for INSERT, UPDATE and DELETE operations.
+    """
+
+    sequence_rows = True
+
+    def on_open(self, remote_cursor, local_cursor):
+        # type: (psycopg2.cursor, psycopg2.cursor) -> int
+        """If the table _sample_table_name does not exist in the local
+        database, creates it and loads a sample of the remote table into it.
+        Otherwise, loads the sampling probabilities of the existing sample.
+
+        This function returns the number of rows in the sample.
+        """
+        if ("min_stratum_rows" in self.options and
+                "strata_column" not in self.options):
+            log_to_postgres(
+                "You need to declare a strata_column option in order to use min_stratum_rows",
+                logging.ERROR)
+        self.local_table_name = "_sample_" + self.table_name
+        self.strata_table_name = self.local_table_name + "_strata"
+        self.sample_columns = [
+            column for column in self.columns if column != SAMPLE_WEIGHT_COLUMN
+        ]
+        self.answer_from_sample = self.options.get("answer_from_sample",
+                                                   "false") == "true"
+        self.fraction = float(self.options.get("sample_fraction", 0.01))
+        self.probabilities = {}  # type: Dict[str, float]
+        if not self.table_exists(local_cursor, self.local_table_name):
+            self.create_table(local_cursor, self.local_table_name, [
+                self.columns[column] for column in self.sample_columns
+            ] + [
+                ColumnDefinition(
+                    SAMPLE_WEIGHT_COLUMN, type_name="double precision")
+            ])
+            local_cursor.execute(
+                "CREATE TABLE {} (stratum TEXT, probability DOUBLE PRECISION)".
+                format(self.strata_table_name))
+            self.sample_remote_table(remote_cursor, local_cursor,
+                                     self.fraction)
+        else:
+            self.load_probabilities(local_cursor)
+        return self.get_count(local_cursor, self.local_table_name)
+
+    def load_probabilities(self, local_cursor):
+        # type: (psycopg2.cursor) -> None
+        """Loads the sampling probabilities of the sample in the local table.
+
+        The probability of rows with a NULL or no stratum is stored with a
+        NULL stratum.
+        """
+        local_cursor.execute("SELECT stratum, probability FROM {}".format(
+            self.strata_table_name))
+        for stratum, probability in local_cursor.fetchall():
+            if stratum is None:
+                self.fraction = probability
+            else:
+                self.probabilities[stratum] = probability
+
+    def stratum_probabilities(self, remote_cursor, fraction):
+        # type: (psycopg2.cursor, float) -> Dict[str, float]
+        """Returns the probability with which each stratum is sampled, which
+        is higher than fraction for strata that would otherwise keep fewer
+        than min_stratum_rows rows.
+        """
+        min_rows = int(self.options.get("min_stratum_rows", 0))
+        if min_rows <= 0:
+            return {}
+        remote_cursor.execute(
+            "SELECT {0}::text, COUNT(*) FROM {1} WHERE {0} IS NOT NULL GROUP BY {0}".
+            format(self.options["strata_column"], self.table_name))
+        probabilities = {}  # type: Dict[str, float]
+        for stratum, count in remote_cursor.fetchall():
+            probabilities[stratum] = max(fraction,
+                                         min(1.0, float(min_rows) / count))
+        return probabilities
+
+    def sample_remote_table(self, remote_cursor, local_cursor, fraction):
+        # type: (psycopg2.cursor, psycopg2.cursor, float) -> None
+        """Replaces the sample in the local table with a new sample of the
+        remote table, in which rows are included with probability fraction,
+        or the higher probability of their stratum.
+        """
+        probabilities = self.stratum_probabilities(remote_cursor, fraction)
+        small_strata = [
+            stratum for stratum, probability in probabilities.items()
+            if probability > fraction
+        ]
+        select_clause = ", ".join(self.sample_columns)
+        local_cursor.execute("TRUNCATE {}".format(self.local_table_name))
+
+        statement = "SELECT {} FROM {} WHERE random() < %s".format(
+            select_clause, self.table_name)
+        parameters = [fraction]  # type: List[Any]
+        if small_strata:
+            statement += " AND ({0} IS NULL OR {0}::text <> ALL(%s))".format(
+                self.options["strata_column"])
+            parameters.append(small_strata)
+        remote_cursor.execute(statement, parameters)
+        self.insert_sampled_rows(local_cursor, remote_cursor, fraction)
+        for stratum in small_strata:
+            probability = probabilities[stratum]
+            remote_cursor.execute(
+                "SELECT {} FROM {} WHERE {}::text = %s AND random() < %s".
+                format(select_clause, self.table_name,
+                       self.options["strata_column"]),
+                (stratum, probability))
+            self.insert_sampled_rows(local_cursor, remote_cursor, probability)
+
+        local_cursor.execute("DELETE FROM {}".format(self.strata_table_name))
+        local_cursor.execute(
+            "INSERT INTO {} (stratum, probability) VALUES (NULL, %s)".format(
+                self.strata_table_name), (fraction, ))
+        for stratum, probability in probabilities.items():
+            local_cursor.execute(
+                "INSERT INTO {} (stratum, probability) VALUES (%s, %s)".format(
+                    self.strata_table_name), (stratum, probability))
+        self.fraction = fraction
+        self.probabilities = probabilities
+
+    def insert_sampled_rows(self, local_cursor, rows, probability):
+        # type: (psycopg2.cursor, Iterable[Any], float) -> None
+        """Inserts the supplied rows, sampled with the supplied probability,
+        into the local table.
+        """
+        weight = 1.0 / probability
+        self.insert_values(local_cursor, self.local_table_name,
+                           (tuple(row) + (weight, ) for row in rows))
+
+    def probability(self, values):  # type: (Dict[str, Any]) -> float
+        """Returns the probability with which a row with the supplied values is
+        sampled.
+
+        Rows in a stratum that did not exist when the remote table was sampled
+        are always sampled if min_stratum_rows is set, since the stratum is
+        still small.
+        """
+        strata_column = self.options.get("strata_column", None)
+        if strata_column is None or values.get(strata_column, None) is None:
+            return self.fraction
+        stratum = str(values[strata_column])
+        if stratum in self.probabilities:
+            return self.probabilities[stratum]
+        if int(self.options.get("min_stratum_rows", 0)) > 0:
+            return 1.0
+        return self.fraction
+
+    def fetch_locally(self, local_cursor, quals, columns, sortkeys=None):
+        # type: (psycopg2.cursor, List[Qual], List[str], List[SortKey]) -> Optional[Iterable[Any]]
+        """If answer_from_sample is set, runs the query on the sample in the
+        local database. Otherwise, the query is run on the remote database.
+        """
+        if not self.answer_from_sample:
+            return None
+        self.execute_fetch_statement(
+            local_cursor, self.local_table_name, quals,
+            self.select_list(columns, SAMPLE_WEIGHT_COLUMN), sortkeys)
+        return self.rows(local_cursor, columns)
+
+    def fetch_remotely(self, remote_cursor, quals, columns, sortkeys=None):
+        # type: (psycopg2.cursor, List[Qual], List[str], List[SortKey]) -> Iterable[Any]
+        """Executes the supplied query against the remote database and returns
+        the result.
+        """
+        self.execute_fetch_statement(remote_cursor, self.table_name, quals,
+                                     self.select_list(columns), sortkeys)
+        return self.rows(remote_cursor, columns)
+
+    @property
+    def rowid_column(self):  # type: () -> str
+        """Returns the 'primary_key' option if it is specified by the user."""
+        row_id_column = self.options.get("primary_key", None)
+        if row_id_column is None:
+            log_to_postgres(
+                "You need to declare a primary_key option in order to use the write API"
+            )
+        return row_id_column
+
+    def insert_locally(self, local_cursor, values):
+        # type: (psycopg2.cursor, Dict[str, Any]) -> int
+        """Adds the inserted row to the sample with the probability of its
+        stratum.
+        """
+        probability = self.probability(values)
+        if random.random() >= probability:
+            return 0
+        sample_values = dict(values)
+        sample_values[SAMPLE_WEIGHT_COLUMN] = 1.0 / probability
+        return self.execute_insert_statement(
+            local_cursor, self.local_table_name, sample_values)
+
+    def insert_remotely(self, remote_cursor, values):
+        # type: (psycopg2.cursor, Dict[str, Any]) -> Dict[str, Any]
+        """Executes the supplied insert statement against the remote databse.
+        """
+        self.execute_insert_statement(remote_cursor, self.table_name, values)
+        return values
+
+    def update_locally(self, local_cursor, oldvalues, newvalues):
+        # type: (psycopg2.cursor, Dict[str, Any], Dict[str, Any]) -> int
+        """Updates the row in the sample, if it was sampled."""
+        self.execute_update_statement(local_cursor, self.local_table_name,
+                                      oldvalues, newvalues)
+        return 0
+
+    def update_remotely(self, remote_cursor, oldvalues, newvalues):
+        # type: (psycopg2.cursor, Dict[str, Any], Dict[str, Any]) -> Dict[str, Any]
+        """Executes the supplied update statement against the remote databse."""
+        self.execute_update_statement(remote_cursor, self.table_name,
+                                      oldvalues, newvalues)
+        return newvalues
+
+    def delete_locally(self, local_cursor, oldvalues):
+        # type: (psycopg2.cursor, Dict[str, Any]) -> int
+        """Deletes the row from the sample, if it was sampled."""
+        return self.execute_delete_statement(
+            local_cursor, self.local_table_name, oldvalues)
+
+    def delete_remotely(self, remote_cursor, oldvalues):
+        # type: (psycopg2.cursor, Dict[str, Any]) -> None
+        """Executes the supplied delete statement against the remote databse.
+        """
+        self.execute_delete_statement(remote_cursor, self.table_name,
+                                      oldvalues)
+
+    @property
+    def routable(self):  # type: () -> bool
+        """Queries answered from the sample must not be sent to the remote
+        database, whose answers are exact.
+        """
+        return not self.answer_from_sample
+
+    def metadata(self):  # type: () -> Dict[str, Any]
+        """Returns whether queries are answered from the sample, and the
+        probability with which rows outside of small strata are sampled.
+        """
+        return {
+            "answer_from_sample": self.answer_from_sample,
+            "sample_fraction": self.fraction
+        }
+
+    def explain(self, quals, columns, sortkeys=None):
+        # type: (List[Qual], List[str], List[SortKey]) -> List[str]
+        """Returns the SQL that answers the query from the sample if
+        answer_from_sample is set, and from the remote database otherwise.
+        """
+        if not self.answer_from_sample:
+            return super(WeightedSamplingStrategy, self).explain(
+                quals, columns, sortkeys)
+        return [
+            "Sample: rows sampled with probability {} outside of small strata".
+            format(self.fraction), "Local SQL: " + self.fetch_statement(
+                self.local_table_name, quals,
+                self.select_list(columns, SAMPLE_WEIGHT_COLUMN), sortkeys)
+        ]
+
+    def fetch_more_rows(self, remote_cursor, local_cursor, oldvalue, newvalue):
+        # type: (psycopg2.cursor, psycopg2.cursor, int, int) -> int
+        """Replaces the sample with a new sample of the remote table whose
+        sample_fraction is high enough for it to hold about newvalue rows.
+        """
+        if newvalue <= oldvalue:
+            return oldvalue
+        remote_count = self.get_count(remote_cursor, self.table_name)
+        fraction = min(1.0, float(newvalue) / max(remote_count, 1))
+        self.sample_remote_table(remote_cursor, local_cursor,
+                                 max(fraction, self.fraction))
+        return self.get_count(local_cursor, self.local_table_name)
@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+"""
+Database-free microbenchmarks for the hot Python paths of the sampling
+strategies.
+
+The SQL builders in ``SamplingStrategy`` and the per-row materialization in the
+fetch generators of every strategy are driven with in-memory fake cursors, so
+no Postgres server (local or remote) is needed. If multicorn or psycopg2 are
+not importable, minimal stand-ins for ``Qual``, ``SortKey``,
+``ColumnDefinition``, ``log_to_postgres`` and ``psycopg2.extras`` are installed
+before ``samplingfdw`` is imported.
+
+For every benchmark the best of several timed repeats is reported as
+nanoseconds per operation (or per row for fetch benchmarks), which keeps the
+numbers stable across runs. When ``tracemalloc`` is available, the number of
+memory blocks still alive per row after materializing a result set is reported
+as well.
+
+The time a fresh interpreter takes to import ``samplingfdw``, and then each
+strategy shipped with it, is reported in milliseconds, also as the best of
+several runs, so that regressions in backend startup time are caught.
+
+Results can be saved with ``--save FILE`` and compared against a saved baseline
+with ``--baseline FILE``; the script exits with status 1 if any benchmark is
+slower than the baseline, or any import slower, by more than ``--tolerance``, so it can be used to
+guard against regressions in CI.
+
+usage: benchmark_strategies.py [--rows N] [--repeat N] [--save FILE]
+                               [--baseline FILE] [--tolerance FRACTION]
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import timeit
+import types
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+ROWS = 10000
+REPEAT = 5
+TOLERANCE = 0.25
+COLUMNS = ["id", "str_column", "int_column"]
+
+
+def install_stubs():
+    """Installs stand-ins for multicorn and psycopg2 if they are missing."""
+    try:
+        import multicorn  # noqa: F401
+    except ImportError:
+        multicorn = types.ModuleType("multicorn")
+        multicorn_utils = types.ModuleType("multicorn.utils")
+
+        class ForeignDataWrapper(object):
+            def __init__(self, options, columns):
+                self.options = options
+                self.columns = columns
+
+        class Qual(object):
+            def __init__(self, field_name, operator, value):
+                self.field_name = field_name
+                self.operator = operator
+                self.value = value
+
+            @property
+            def is_list_operator(self):
+                return isinstance(self.operator, tuple)
+
+            @property
+            def list_any_or_all(self):
+                if not self.is_list_operator:
+                    return None
+                return "ANY" if self.operator[1] else "ALL"
+
+            def __repr__(self):
+                if self.is_list_operator:
+                    return "%s %s %s(%s)" % (self.field_name, self.operator[0],
+                                             self.list_any_or_all, self.value)
+                return "%s %s %s" % (self.field_name, self.operator,
+                                     self.value)
+
+            def __eq__(self, other):
+                return (isinstance(other, Qual) and
+                        self.field_name == other.field_name and
+                        self.operator == other.operator and
+                        self.value == other.value)
+
+            def __ne__(self, other):
+                return not self == other
+
+            def __hash__(self):
+                return hash((self.field_name, str(self.operator),
+                             str(self.value)))
+
+        class SortKey(object):
+            def __init__(self, attname, attnum, is_reversed, nulls_first,
+                         collate):
+                self.attname = attname
+                self.attnum = attnum
+                self.is_reversed = is_reversed
+                self.nulls_first = nulls_first
+                self.collate = collate
+
+        class ColumnDefinition(object):
+            def __init__(self, column_name, type_oid=0, typmod=0,
+                         type_name="", base_type_name="", options=None):
+                self.column_name = column_name
+                self.type_oid = type_oid
+                self.typmod = typmod
+                self.type_name = type_name
+                self.base_type_name = base_type_name
+                self.options = options or {}
+
+            def to_statement(self):
+                return "%s %s" % (self.column_name, self.type_name)
+
+        def log_to_postgres(message, level=None, hint=None, detail=None):
+            if level is not None and level >= 40:
+                raise RuntimeError(message)
+
+        multicorn.ForeignDataWrapper = ForeignDataWrapper
+        multicorn.Qual = Qual
+        multicorn.SortKey = SortKey
+        multicorn.ColumnDefinition = ColumnDefinition
+        multicorn.ANY = "ANY"
+        multicorn.ALL = "ALL"
+        multicorn_utils.log_to_postgres = log_to_postgres
+        multicorn.utils = multicorn_utils
+        sys.modules["multicorn"] = multicorn
+        sys.modules["multicorn.utils"] = multicorn_utils
+
+    try:
+        import psycopg2  # noqa: F401
+        import psycopg2.extras  # noqa: F401
+    except ImportError:
+        psycopg2 = types.ModuleType("psycopg2")
+        psycopg2_extras = types.ModuleType("psycopg2.extras")
+
+        def connect(**kwargs):
+            raise RuntimeError("No database is available in the benchmarks")
+
+        def execute_values(cursor, statement, rows, page_size=100):
+            for row in rows:
+                cursor.execute(statement, row)
+
+        psycopg2.connect = connect
+        psycopg2.connection = object
+        psycopg2.cursor = object
+        psycopg2_extras.execute_values = execute_values
+        psycopg2.extras = psycopg2_extras
+        sys.modules["psycopg2"] = psycopg2
+        sys.modules["psycopg2.extras"] = psycopg2_extras
+
+
+class FakeCursor(object):
+    """An in-memory stand-in for a psycopg2 cursor.
+
+    Every execute call records the statement, and iterating through the cursor
+    yields the supplied rows. fetchone returns the value in fetchone_results
+    whose key appears in the last statement, or the first row otherwise.
+    """
+
+    def __init__(self, rows=(), fetchone_results=None):
+        self.rows = rows
+        self.fetchone_results = fetchone_results or {}
+        self.statement = None
+        self.parameters = None
+        self.rowcount = 1
+
+    def execute(self, statement, parameters=None):
+        self.statement = statement
+        self.parameters = parameters
+
+    def fetchone(self):
+        for key, result in self.fetchone_results.items():
+            if key in self.statement:
+                return result
+        return self.rows[0] if self.rows else None
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def make_rows(count):
+    return [(i, "foo" if i % 2 == 0 else "bar", i % 10000)
+            for i in range(count)]
+
+
+def make_strategies():
+    from multicorn import ColumnDefinition
+    from samplingfdw.remote_sampling_strategy import RemoteSamplingStrategy
+    from samplingfdw.selection_sampling_strategy import (
+        SelectionSamplingStrategy)
+
+    column_definitions = {
+        "id": ColumnDefinition("id", type_name="integer"),
+        "str_column": ColumnDefinition("str_column", type_name="varchar(3)"),
+        "int_column": ColumnDefinition("int_column", type_name="integer"),
+    }
+    options = {
+        "table_name": "remote_table",
+        "primary_key": "id",
+        "column": "str_column",
+        "column_values": "foo",
+    }
+    remote = RemoteSamplingStrategy("remote_table", options,
+                                    column_definitions)
+    selection = SelectionSamplingStrategy("remote_table", options,
+                                          column_definitions)
+    # The local table already exists and is not partitioned
+    selection.on_open(
+        FakeCursor(),
+        FakeCursor(fetchone_results={
+            "information_schema": (True, ),
+            "pg_partitioned_table": (False, ),
+            "COUNT": (0, )
+        }))
+    return remote, selection
+
+
+def consume(results):
+    """Iterates through fetch results without keeping them alive."""
+    if results is None:
+        return
+    for _ in results:
+        pass
+
+
+def materialize(results):
+    """Keeps every row of the fetch results alive."""
+    return [] if results is None else list(results)
+
+
+def benchmarks(rows):
+    """Returns a list of (name, rows per operation, function) tuples.
+
+    Each function takes a sink that is called with the output of the
+    benchmarked operation.
+    """
+    from multicorn import Qual
+    from samplingfdw.sampling_strategy import SamplingStrategy
+
+    remote, selection = make_strategies()
+    data = make_rows(rows)
+    cursor = FakeCursor(data)
+    quals = [Qual("str_column", "=", "foo"), Qual("int_column", ">", 5000)]
+    values = {"id": 1, "str_column": "foo", "int_column": 10}
+    newvalues = {"id": 1, "str_column": "bar", "int_column": 20}
+
+    return [
+        ("execute_fetch_statement", 1,
+         lambda sink: SamplingStrategy.execute_fetch_statement(
+             cursor, "remote_table", quals, COLUMNS)),
+        ("execute_insert_statement", 1,
+         lambda sink: SamplingStrategy.execute_insert_statement(
+             cursor, "remote_table", values)),
+        ("execute_update_statement", 1,
+         lambda sink: SamplingStrategy.execute_update_statement(
+             cursor, "remote_table", values, newvalues)),
+        ("remote.fetch_remotely", rows,
+         lambda sink: sink(remote.fetch_remotely(cursor, quals, COLUMNS))),
+        ("selection.fetch_locally", rows,
+         lambda sink: sink(selection.fetch_locally(cursor, quals, COLUMNS))),
+        ("selection.fetch_remotely", rows,
+         lambda sink: sink(selection.fetch_remotely(cursor, quals, COLUMNS))),
+    ]
+
+
+def time_benchmark(function, rows_per_op, repeat):
+    """Returns the best time per row in nanoseconds."""
+    number = max(1, 100000 // rows_per_op)
+    function(consume)
+    gc.collect()
+    best = min(
+        timeit.repeat(
+            lambda: function(consume), number=number, repeat=repeat))
+    return best / (number * rows_per_op) * 1e9
+
+
+def measure_allocations(function, rows_per_op):
+    """Returns the number of memory blocks kept alive per row when the results
+    of a fetch benchmark are materialized, or None if unavailable.
+    """
+    if tracemalloc is None or rows_per_op == 1:
+        return None
+    kept = []
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    function(lambda results: kept.append(materialize(results)))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff
+                 for stat in after.compare_to(before, "filename"))
+    return float(blocks) / rows_per_op
+
+
+IMPORT_CODE = """
+import json, sys, time
+sys.path.insert(0, {scripts!r})
+import benchmark_strategies
+benchmark_strategies.install_stubs()
+start = time.time()
+from samplingfdw.sampling_strategy_registry import SamplingStrategyRegistry
+package = time.time() - start
+SamplingStrategyRegistry.get_strategy({name!r})
+print(json.dumps([package, SamplingStrategyRegistry.import_times[{name!r}]]))
+"""
+
+
+def measure_import_time(name, repeat):
+    """Returns the best times in milliseconds that a fresh interpreter takes to
+    import samplingfdw, and then the strategy registered for name.
+    """
+    code = IMPORT_CODE.format(
+        scripts=os.path.dirname(os.path.abspath(__file__)), name=name)
+    times = [
+        json.loads(subprocess.check_output([sys.executable, "-c", code]))
+        for _ in range(repeat)
+    ]
+    return (min(package for package, _ in times) * 1e3,
+            min(strategy for _, strategy in times) * 1e3)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Database-free microbenchmarks for samplingfdw.")
+    parser.add_argument("--rows", type=int, default=ROWS)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--save", help="write the results to a JSON file")
+    parser.add_argument("--baseline", help="compare against a JSON file")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    install_stubs()
+    results = {}
+    print("{:<28} {:>12} {:>14}".format("benchmark", "ns/row", "blocks/row"))
+    for name, rows_per_op, function in benchmarks(args.rows):
+        ns_per_row = time_benchmark(function, rows_per_op, args.repeat)
+        blocks_per_row = measure_allocations(function, rows_per_op)
+        results[name] = {
+            "ns_per_row": ns_per_row,
+            "blocks_per_row": blocks_per_row
+        }
+        print("{:<28} {:>12.1f} {:>14}".format(
+            name, ns_per_row, "-" if blocks_per_row is None else
+            "{:.2f}".format(blocks_per_row)))
+
+    from samplingfdw.sampling_strategy_registry import STRATEGY_MODULES
+
+    print("\n{:<28} {:>12}".format("import", "ms"))
+    package_times = []
+    for name in sorted(STRATEGY_MODULES):
+        package_ms, strategy_ms = measure_import_time(name, args.repeat)
+        package_times.append(package_ms)
+        results["import:" + name] = {"import_ms": strategy_ms}
+        print("{:<28} {:>12.2f}".format(name, strategy_ms))
+    results["import:samplingfdw"] = {"import_ms": min(package_times)}
+    print("{:<28} {:>12.2f}".format("samplingfdw", min(package_times)))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name in sorted(results):
+            if name not in baseline:
+                continue
+            metric = "import_ms" if name.startswith("import:") else "ns_per_row"
+            if (results[name][metric] >
+                    baseline[name][metric] * (1 + args.tolerance)):
+                regressions.append(name)
+                sys.stderr.write("regression: {} {:.2f} {} > {:.2f} {}\n".format(
+                    name, results[name][metric], metric,
+                    baseline[name][metric], metric))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
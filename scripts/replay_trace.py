@@ -0,0 +1,120 @@
+#!/usr/bin/env python2
+"""
+Runs the queries recorded by a SamplingFdw with the trace option again against
+another foreign table, and logs the time taken for the queries.
+
+The target table is usually a second foreign table over the same remote table,
+configured with the sampling strategy options being tuned, and must have the
+trace option set too, with the name target_fdw_name. Queries are run in the
+order they were recorded, with the same quals, requested columns and sort
+keys. The total, mean, median and 95th percentile time per query are printed
+for the recorded scans and for the scans the target recorded while they were
+replayed, which are timed the same way, and, for reference, for the replayed
+queries end to end, which includes planning and sending the rows to this
+script.
+"""
+
+from __future__ import print_function
+
+import json
+import psycopg2
+import sys
+import time
+
+DBNAME = "postgres"
+TRACE_TABLE = "_samplingfdw_trace"
+
+
+def build_query(table_name, quals, columns, sortkeys):
+    """Returns the statement and parameters that run a recorded query against
+    the supplied table.
+    """
+    conditions = []
+    parameters = []
+    for qual in quals:
+        operator = qual["operator"]
+        if isinstance(operator, list):
+            conditions.append("{} {} {}(%s)".format(
+                qual["field_name"], operator[0], "ANY"
+                if operator[1] else "ALL"))
+            parameters.append(qual["value"])
+        elif qual["value"] is None:
+            conditions.append("{} IS {}NULL".format(
+                qual["field_name"], "NOT " if operator == "<>" else ""))
+        else:
+            conditions.append("{} {} %s".format(qual["field_name"], operator))
+            parameters.append(qual["value"])
+
+    statement = "SELECT {} FROM {}".format(", ".join(columns) or "1",
+                                           table_name)
+    if conditions:
+        statement += " WHERE " + " AND ".join(conditions)
+    if sortkeys:
+        statement += " ORDER BY " + ", ".join(
+            "{}{}{}".format(sortkey["attname"], " DESC"
+                            if sortkey["is_reversed"] else "", " NULLS FIRST"
+                            if sortkey["nulls_first"] else " NULLS LAST")
+            for sortkey in sortkeys)
+    return statement, parameters
+
+
+def summarize(label, durations):
+    durations = sorted(durations)
+    if not durations:
+        print("{}: no queries".format(label))
+        return
+    print("{}: {} queries, total {:.3f} s, mean {:.3f} ms, median {:.3f} ms, "
+          "p95 {:.3f} ms".format(label,
+                                 len(durations),
+                                 sum(durations),
+                                 sum(durations) / len(durations) * 1000,
+                                 durations[len(durations) // 2] * 1000,
+                                 durations[int(len(durations) * 0.95)] * 1000))
+
+
+def main():
+    if len(sys.argv) < 4:
+        sys.stderr.write(
+            "usage: {} sampling_fdw_name target_table target_fdw_name "
+            "[trace_table [target_trace_table]]\n".format(sys.argv[0]))
+        sys.exit(1)
+
+    trace_table = sys.argv[4] if len(sys.argv) > 4 else TRACE_TABLE
+    target_trace_table = sys.argv[5] if len(sys.argv) > 5 else trace_table
+    conn = psycopg2.connect(dbname=DBNAME)
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT quals, columns, sortkeys, seconds FROM {} WHERE name = %s ORDER BY traced_at".
+        format(trace_table), (sys.argv[1], ))
+    traces = cursor.fetchall()
+
+    recorded = []
+    end_to_end = []
+    replay_start = time.time()
+    for quals, columns, sortkeys, seconds in traces:
+        if seconds is not None:
+            recorded.append(seconds)
+        statement, parameters = build_query(sys.argv[2], json.loads(quals),
+                                            json.loads(columns),
+                                            json.loads(sortkeys))
+        start_time = time.time()
+        cursor.execute(statement, parameters)
+        for _ in cursor:
+            pass
+        end_to_end.append(time.time() - start_time)
+        conn.commit()
+
+    cursor.execute(
+        "SELECT seconds FROM {} WHERE name = %s AND traced_at >= %s AND seconds IS NOT NULL".
+        format(target_trace_table), (sys.argv[3], replay_start))
+    replayed = [seconds for seconds, in cursor]
+    cursor.close()
+    conn.close()
+
+    summarize("recorded (scan)", recorded)
+    summarize("replayed (scan)", replayed)
+    summarize("replayed (end to end)", end_to_end)
+
+
+if __name__ == "__main__":
+    main()
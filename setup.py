@@ -6,6 +6,7 @@ setup(
     author='Lee Ehudin',
     packages=['samplingfdw'],
     install_requires=['Multicorn', 'psycopg2>=2.6.2', 'typing>=3.5.3.0'],
+    extras_require={'columnar': ['numpy']},
     dependency_links=[
         'http://github.com/Kozea/Multicorn/tarball/master#egg=Multicorn-1.3.2'
     ])